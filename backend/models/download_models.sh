@@ -11,6 +11,9 @@ curl -O https://raw.githubusercontent.com/justadudewhohacks/face-api.js/master/w
 curl -O https://raw.githubusercontent.com/justadudewhohacks/face-api.js/master/weights/tiny_face_detector_model-weights_manifest.json
 curl -O https://raw.githubusercontent.com/justadudewhohacks/face-api.js/master/weights/tiny_face_detector_model-shard1
 
+# Download res10 SSD face detector weights (used with deploy.prototxt)
+curl -O https://raw.githubusercontent.com/opencv/opencv_3rdparty/dnn_samples_face_detector_20170830/res10_300x300_ssd_iter_140000.caffemodel
+
 # Move files to appropriate directories
 mv face_landmark_68_model-* face_landmark_68/
 mv tiny_face_detector_model-* tiny_face_detector/
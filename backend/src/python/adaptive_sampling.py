@@ -0,0 +1,115 @@
+import cv2
+import numpy as np
+from detection_timeline import DetectionTimeline
+from face_detectors import mouth_patch
+from frame_sampler import read_frames_at
+
+# Coarse pass rate; switch points found there are refined by bisection
+COARSE_SAMPLES_PER_SECOND = 1
+
+
+def refine_boundaries(intervals, label_at, min_step=1):
+    """
+    Locate label changes by bisection.
+
+    intervals: (left_frame, right_frame, left_label, right_label) with differing labels
+    label_at: called once per round with [(frame_number, left_label, right_label), ...]
+    for the midpoints of all still-open intervals; returns one label per request
+    Returns (first frame with right_label for each interval, accurate to min_step frames,
+    number of frames labelled).
+    """
+    lo = [int(left) for left, _, _, _ in intervals]
+    hi = [int(right) for _, right, _, _ in intervals]
+    labelled = 0
+    while True:
+        open_intervals = [i for i in range(len(intervals)) if hi[i] - lo[i] > min_step]
+        if not open_intervals:
+            break
+        midpoints = [(lo[i] + hi[i]) // 2 for i in open_intervals]
+        labels = label_at([(mid, intervals[i][2], intervals[i][3]) for i, mid in zip(open_intervals, midpoints)])
+        labelled += len(midpoints)
+        for i, mid, label in zip(open_intervals, midpoints, labels):
+            if label == intervals[i][2]:
+                lo[i] = mid
+            else:
+                hi[i] = mid
+    return hi, labelled
+
+def mouth_probe(video_path, fps, step_seconds=0.1):
+    """
+    label_at for refine_boundaries when labels are (label, (x1, y1, x2, y2)) speaker candidates.
+
+    Around each requested frame the mouth region of both candidates' boxes is compared
+    one step before and after; the candidate whose mouth changes more is speaking. No
+    detector runs: boxes come from the coarse samples around the switch.
+    """
+    step = max(1, int(round(fps * step_seconds)))
+    offsets = (-step, 0, step)
+
+    def mouth_activity(frames, frame_number, box):
+        x1, y1, x2, y2 = box
+        patches = []
+        for offset in offsets:
+            frame = frames.get(frame_number + offset)
+            if frame is None:
+                continue
+            patches.append(mouth_patch(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB), (y1, x2, y2, x1)))
+        patches = [patch for patch in patches if patch is not None]
+        if len(patches) < 2:
+            return 0.0
+        return float(np.mean([np.abs(b - a).mean() for a, b in zip(patches, patches[1:])]))
+
+    def label_at(requests):
+        wanted = [max(0, frame_number + offset) for frame_number, _, _ in requests for offset in offsets]
+        frames = read_frames_at(video_path, wanted)
+        labels = []
+        for frame_number, left, right in requests:
+            left_activity = mouth_activity(frames, frame_number, left[1])
+            right_activity = mouth_activity(frames, frame_number, right[1])
+            labels.append(right if right_activity > left_activity else left)
+        return labels
+
+    return label_at
+
+def refine_switches(timeline, fps, label_at, labels=None, min_step=1, cuts=()):
+    """
+    Add a row at the exact frame each switch happens, between coarse samples of a
+    one-row-per-sample speaker timeline.
+
+    labels: speaker identity per row (defaults to the timeline's track IDs)
+    cuts: shot boundaries (first frames of shots); a switch across a cut happens at the cut
+    Each inserted row repeats the sample after the switch at the refined time. Returns
+    (refined timeline, number of frames analysed during refinement).
+    """
+    if len(timeline) < 2:
+        return timeline, 0
+    labels = timeline.track_ids if labels is None else np.asarray(labels)
+    switches = np.flatnonzero(labels[1:] != labels[:-1])
+    if not switches.size:
+        return timeline, 0
+
+    frame_numbers = np.round(timeline.times * fps).astype(np.int64)
+    boxes = [tuple(box) for box in timeline.boxes.tolist()]
+    cuts = np.asarray(cuts, dtype=np.int64)
+    # First cut after each switch's left sample; only cuts inside the interval count
+    next_cut = np.searchsorted(cuts, frame_numbers[switches], side='right')
+    at_cut = {}
+    for i, cut_index in zip(switches, next_cut):
+        if cut_index < len(cuts) and cuts[cut_index] <= frame_numbers[i + 1]:
+            at_cut[i] = int(cuts[cut_index])
+
+    bisect = [i for i in switches if i not in at_cut]
+    intervals = [
+        (frame_numbers[i], frame_numbers[i + 1], (labels[i], boxes[i]), (labels[i + 1], boxes[i + 1]))
+        for i in bisect
+    ]
+    bisected, labelled = refine_boundaries(intervals, label_at, min_step)
+    boundary_of = dict(at_cut)
+    boundary_of.update(zip(bisect, bisected))
+    boundaries = [boundary_of[i] for i in switches]
+
+    inserted = timeline.select(switches + 1)
+    inserted.times = np.asarray(boundaries, dtype=np.float64) / fps
+    # Boundaries that landed on the coarse sample itself add nothing
+    inserted = inserted.select(inserted.times < timeline.times[switches + 1])
+    return DetectionTimeline.concatenate([timeline, inserted]).sorted(), labelled
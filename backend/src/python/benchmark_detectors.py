@@ -0,0 +1,140 @@
+"""
+Compare face detector and lip-activity backends on the same frames.
+
+    python benchmark_detectors.py [video_path] [frame_count]
+
+Without a video a synthetic clip (two drawn faces, one of them talking) is generated in a
+temporary directory, so runs are comparable across machines. One "benchmark" event per
+detector backend and one "lip_benchmark" event per lip-activity backend (see
+lip_activity.py) is printed with its latency and face count; backends whose model files
+or packages are missing are reported as skipped.
+"""
+import os
+import sys
+import time
+import tempfile
+import cv2
+import numpy as np
+import face_detectors
+from lip_activity import LIP_ACTIVITY_BACKENDS, make_lip_activity
+from frame_sampler import iter_sampled_frames
+from media_probe import probe_media
+from reporting import emit, report_result
+
+
+def make_synthetic_clip(path, frame_count=60, size=(1280, 720), fps=30):
+    """Two cartoon faces on a plain background; the left one opens and closes its mouth"""
+    width, height = size
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, size)
+    for i in range(frame_count):
+        frame = np.full((height, width, 3), (90, 110, 120), dtype=np.uint8)
+        for index, cx in enumerate((width // 3, 2 * width // 3)):
+            cy = height // 2
+            cv2.ellipse(frame, (cx, cy), (110, 145), 0, 0, 360, (140, 170, 215), -1)
+            for eye_x in (cx - 42, cx + 42):
+                cv2.ellipse(frame, (eye_x, cy - 35), (20, 10), 0, 0, 360, (255, 255, 255), -1)
+                cv2.circle(frame, (eye_x, cy - 35), 8, (40, 30, 20), -1)
+            cv2.line(frame, (cx, cy - 20), (cx - 10, cy + 25), (110, 130, 180), 4)
+            opening = int(4 + 14 * abs(np.sin(i / 3))) if index == 0 else 4
+            cv2.ellipse(frame, (cx, cy + 70), (38, opening), 0, 0, 360, (60, 50, 140), -1)
+        writer.write(frame)
+    writer.release()
+    return path
+
+def load_frames(video_path, frame_count):
+    """First frame_count frames as RGB"""
+    frames = []
+    for _, frame in iter_sampled_frames(video_path, 1, end_frame=frame_count):
+        frames.append(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+    return frames
+
+def available_backends():
+    """name -> (detect(frames) returning one box list per frame, or None, reason skipped)"""
+    backends = {
+        "haar": (lambda frames: [face_detectors.detect_faces_fast(frame) for frame in frames], None),
+        "hog": (lambda frames: [face_detectors.detect_faces_hog(frame) for frame in frames], None),
+    }
+    if face_detectors.get_ssd_net() is not None:
+        backends["ssd"] = (face_detectors.detect_faces_ssd_batch, None)
+    else:
+        backends["ssd"] = (None, f"{face_detectors.SSD_WEIGHTS} not found")
+    if face_detectors.find_hf_model(face_detectors.YUNET_REPO, face_detectors.YUNET_MODEL) is not None:
+        backends["yunet"] = (
+            lambda frames: [[box for box, _ in face_detectors.detect_faces_yunet(frame)] for frame in frames],
+            None
+        )
+    else:
+        backends["yunet"] = (None, f"{face_detectors.YUNET_MODEL} not found")
+    return backends
+
+def benchmark(frames, batch_size=3):
+    """Time every available backend over frames, batch_size frames per call (like the three cameras)"""
+    results = {}
+    for name, (detect, skipped) in available_backends().items():
+        if detect is None:
+            emit("benchmark", backend=name, skipped=skipped)
+            continue
+
+        # Warm up: model loading and first-call allocation are not part of per-frame cost
+        detect(frames[:1])
+        faces = 0
+        started = time.perf_counter()
+        for i in range(0, len(frames), batch_size):
+            faces += sum(len(boxes) for boxes in detect(frames[i:i + batch_size]))
+        elapsed = time.perf_counter() - started
+
+        results[name] = {
+            "ms_per_frame": round(1000 * elapsed / len(frames), 2),
+            "faces_per_frame": round(faces / len(frames), 2)
+        }
+        emit("benchmark", backend=name, frames=len(frames), **results[name])
+    return results
+
+def benchmark_lip_activity(frames, fps=30):
+    """
+    Time every lip-activity backend over frames in order, each finding its own faces as it
+    would in its pipeline. left_face_chosen is the share of frames with two or more faces
+    where the leftmost face scored highest; on the synthetic clip that is the talking one.
+    """
+    results = {}
+    for name in LIP_ACTIVITY_BACKENDS:
+        try:
+            # Warm up on a throwaway instance, so timing starts from a fresh stream with models loaded
+            warm = make_lip_activity(name)
+            warm.measure(frames[0], 0.0)
+            warm.close()
+            activity = make_lip_activity(name)
+        except ImportError as e:
+            emit("lip_benchmark", backend=name, skipped=str(e))
+            continue
+
+        faces, chosen, contested = 0, 0, 0
+        started = time.perf_counter()
+        for i, frame in enumerate(frames):
+            scored = activity.measure(frame, i / fps)
+            faces += len(scored)
+            if len(scored) > 1:
+                contested += 1
+                best = max(scored, key=lambda face: face[2])[0]
+                chosen += best[3] == min(face_location[3] for face_location, _, _ in scored)
+        elapsed = time.perf_counter() - started
+        activity.close()
+
+        results[name] = {
+            "ms_per_frame": round(1000 * elapsed / len(frames), 2),
+            "faces_per_frame": round(faces / len(frames), 2),
+            "left_face_chosen": round(chosen / contested, 2) if contested else None
+        }
+        emit("lip_benchmark", backend=name, frames=len(frames), **results[name])
+    return results
+
+if __name__ == "__main__":
+    frame_count = int(sys.argv[2]) if len(sys.argv) > 2 else 60
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if len(sys.argv) > 1:
+            video_path = sys.argv[1]
+        else:
+            video_path = make_synthetic_clip(os.path.join(tmp_dir, "synthetic_faces.mp4"), frame_count)
+        frames = load_frames(video_path, frame_count)
+        fps = probe_media(video_path)['fps'] or 30
+        report_result({"detectors": benchmark(frames), "lip_activity": benchmark_lip_activity(frames, fps)})
@@ -0,0 +1,104 @@
+import subprocess
+import cv2
+import numpy as np
+
+
+def fit_to_aspect(rects, aspect):
+    """
+    Shrink (x, y, w, h) rects around their centers to the output aspect ratio,
+    like scale=...:force_original_aspect_ratio=increase followed by a center crop
+    """
+    rects = np.asarray(rects, dtype=np.float64).reshape(-1, 4)
+    x, y, w, h = rects.T
+    too_wide = w / np.maximum(h, 1) > aspect
+    new_w = np.where(too_wide, h * aspect, w)
+    new_h = np.where(too_wide, h, w / aspect)
+    x = x + (w - new_w) / 2
+    y = y + (h - new_h) / 2
+    return np.column_stack([x, y, np.maximum(new_w, 2), np.maximum(new_h, 2)]).round().astype(np.int32)
+
+def expand_boxes(boxes, width, height, expand_factor=2.75):
+    """
+    Crop rects (x, y, w, h) around face boxes (x1, y1, x2, y2), expanded and clamped to the frame
+    the same way the per-segment filter graph did
+    """
+    boxes = np.asarray(boxes, dtype=np.int64).reshape(-1, 4)
+    x1, y1, x2, y2 = boxes.T
+    cx, cy = (x1 + x2) // 2, (y1 + y2) // 2
+    new_w = ((x2 - x1) * expand_factor).astype(np.int64)
+    new_h = ((y2 - y1) * expand_factor).astype(np.int64)
+    new_x1 = np.maximum(0, cx - new_w // 2)
+    new_y1 = np.maximum(0, cy - new_h // 2)
+    new_x2 = np.minimum(width, new_x1 + new_w)
+    new_y2 = np.minimum(height, new_y1 + new_h)
+    return np.column_stack([new_x1, new_y1, new_x2 - new_x1, new_y2 - new_y1])
+
+def crop_track_from_segments(segments, total_frames, fps, width, height, expand_factor=2.75):
+    """
+    Per-output-frame crop rects (x, y, w, h) for merged segments (a DetectionTimeline).
+    Each segment's crop holds until the next segment starts; frames before the first segment
+    show the full frame.
+    """
+    track = np.tile(np.array([0, 0, width, height], dtype=np.int32), (total_frames, 1))
+    if not len(segments):
+        return track
+
+    rects = fit_to_aspect(expand_boxes(segments.boxes, width, height, expand_factor), width / height)
+
+    segment_index = np.searchsorted(segments.times, np.arange(total_frames) / fps, side='right') - 1
+    covered = segment_index >= 0
+    track[covered] = rects[segment_index[covered]]
+    return track
+
+def render_crop_track(input_video, output_video, crop_track, width, height, fps, stage=None):
+    """
+    Decode the input once, crop and scale every frame by its row in crop_track and pipe the
+    result to a single ffmpeg encoder; audio is taken from the input.
+    Cost depends on the frame count only, not on how many times the crop changes.
+    stage: optional reporting.Stage that receives frame counts and throttled progress
+    """
+    ffmpeg_cmd = [
+        "ffmpeg", "-y",
+        "-f", "rawvideo",
+        "-pix_fmt", "bgr24",
+        "-s", f"{width}x{height}",
+        "-r", str(fps),
+        "-i", "pipe:0",
+        "-i", input_video,
+        "-map", "0:v",
+        "-map", "1:a?",
+        "-c:v", "libx264",
+        "-pix_fmt", "yuv420p",
+        "-c:a", "aac",
+        "-shortest",
+        output_video
+    ]
+    encoder = subprocess.Popen(ffmpeg_cmd, stdin=subprocess.PIPE)
+    cap = cv2.VideoCapture(input_video)
+    last_row = len(crop_track) - 1
+
+    try:
+        frame_index = 0
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            x, y, w, h = crop_track[min(frame_index, last_row)]
+            crop = frame[y:y + h, x:x + w]
+            if crop.shape[1] != width or crop.shape[0] != height:
+                interpolation = cv2.INTER_AREA if w > width else cv2.INTER_LINEAR
+                crop = cv2.resize(crop, (width, height), interpolation=interpolation)
+            encoder.stdin.write(np.ascontiguousarray(crop).tobytes())
+
+            frame_index += 1
+            if stage is not None:
+                stage.add_frames()
+                stage.progress(frame_index / len(crop_track))
+    finally:
+        cap.release()
+        encoder.stdin.close()
+        returncode = encoder.wait()
+
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, ffmpeg_cmd)
+    return output_video
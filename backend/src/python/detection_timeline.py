@@ -0,0 +1,136 @@
+import numpy as np
+
+
+class DetectionTimeline:
+    """
+    Face detections over time as parallel arrays instead of one dict per detection:
+    times (seconds), boxes (x1, y1, x2, y2), scores and track_ids (-1 when untracked).
+
+    Rows are kept in time order. The speaking-frame JSON shape
+    ({"start_time", "bbox": {"top_left", "bottom_right"}}) is only produced at the
+    edges via to_records / from_records.
+    """
+
+    def __init__(self, times=(), boxes=(), scores=None, track_ids=None):
+        self.times = np.asarray(times, dtype=np.float64).reshape(-1)
+        self.boxes = np.asarray(boxes, dtype=np.int32).reshape(-1, 4)
+        count = len(self.times)
+        self.scores = (np.ones(count, dtype=np.float32) if scores is None
+                       else np.asarray(scores, dtype=np.float32).reshape(-1))
+        self.track_ids = (np.full(count, -1, dtype=np.int32) if track_ids is None
+                          else np.asarray(track_ids, dtype=np.int32).reshape(-1))
+        if not (len(self.boxes) == len(self.scores) == len(self.track_ids) == count):
+            raise ValueError("times, boxes, scores and track_ids must have the same length")
+
+    def __len__(self):
+        return len(self.times)
+
+    def select(self, index):
+        """Rows at index (integer array, slice or boolean mask) as a new timeline"""
+        return DetectionTimeline(self.times[index], self.boxes[index], self.scores[index], self.track_ids[index])
+
+    def sorted(self):
+        return self.select(np.argsort(self.times, kind='stable'))
+
+    @classmethod
+    def concatenate(cls, timelines):
+        timelines = list(timelines)
+        if not timelines:
+            return cls()
+        return cls(np.concatenate([t.times for t in timelines]),
+                   np.concatenate([t.boxes for t in timelines]),
+                   np.concatenate([t.scores for t in timelines]),
+                   np.concatenate([t.track_ids for t in timelines]))
+
+    @classmethod
+    def from_records(cls, records):
+        """Build from speaking-frame dicts; optional "score" and "track_id" keys are kept"""
+        return cls(
+            [record["start_time"] for record in records],
+            [list(record["bbox"]["top_left"]) + list(record["bbox"]["bottom_right"]) for record in records],
+            [record.get("score", 1.0) for record in records],
+            [record.get("track_id", -1) for record in records]
+        )
+
+    def to_records(self):
+        """Speaking-frame dicts as used in JSON output; track_id is included for tracked rows"""
+        records = []
+        for time, (x1, y1, x2, y2), track_id in zip(self.times.tolist(), self.boxes.tolist(), self.track_ids.tolist()):
+            record = {
+                "start_time": time,
+                "bbox": {"top_left": [x1, y1], "bottom_right": [x2, y2]}
+            }
+            if track_id >= 0:
+                record["track_id"] = track_id
+            records.append(record)
+        return records
+
+def box_iou(box, boxes):
+    """IoU of one (x1, y1, x2, y2) box against an (N, 4) array of boxes"""
+    return iou_matrix(np.asarray(box).reshape(1, 4), boxes)[0]
+
+def iou_matrix(boxes_a, boxes_b):
+    """Pairwise IoU of (N, 4) and (M, 4) box arrays as an (N, M) matrix"""
+    a = np.asarray(boxes_a, dtype=np.float64).reshape(-1, 1, 4)
+    b = np.asarray(boxes_b, dtype=np.float64).reshape(1, -1, 4)
+    width = np.clip(np.minimum(a[..., 2], b[..., 2]) - np.maximum(a[..., 0], b[..., 0]), 0, None)
+    height = np.clip(np.minimum(a[..., 3], b[..., 3]) - np.maximum(a[..., 1], b[..., 1]), 0, None)
+    intersection = width * height
+    area_a = (a[..., 2] - a[..., 0]) * (a[..., 3] - a[..., 1])
+    area_b = (b[..., 2] - b[..., 0]) * (b[..., 3] - b[..., 1])
+    union = area_a + area_b - intersection
+    return np.divide(intersection, union, out=np.zeros_like(intersection), where=union > 0)
+
+def merge_similar_segments(timeline, iou_threshold=0.7, min_duration=1.0, block_size=32):
+    """
+    Merge similar segments and filter out short duration switches.
+
+    A segment starts at an anchor detection and absorbs every later detection until one
+    overlaps the anchor's box by less than iou_threshold at least min_duration after the
+    anchor; that detection becomes the next anchor. The last segment is kept if the
+    timeline runs on for min_duration after its anchor. Returns the anchors.
+
+    The next anchor is searched for in vectorized blocks of detections that double in
+    size while nothing is found, so the Python loop runs a few times per segment rather
+    than once per detection, and frequent switches don't pay for large blocks.
+    Timelines must be sorted by time.
+    """
+    count = len(timeline)
+    if count == 0:
+        return DetectionTimeline()
+
+    times = timeline.times
+    boxes = timeline.boxes
+    # Detections closer than min_duration to an anchor can never start the next segment,
+    # so each search starts at (slightly before, to allow for rounding) the first one later
+    earliest = np.searchsorted(times, times + min_duration - 1e-6, side='left')
+
+    anchors = []
+    anchor = 0
+    # Segments tend to have similar lengths; size the first block from the previous one
+    expected_length = block_size
+    while True:
+        next_anchor = None
+        start = max(anchor + 1, earliest[anchor])
+        block = expected_length
+        while start < count:
+            end = min(count, start + block)
+            switches = ((box_iou(boxes[anchor], boxes[start:end]) < iou_threshold)
+                        & (times[start:end] - times[anchor] >= min_duration))
+            first = switches.argmax()
+            if switches[first]:
+                next_anchor = start + first
+                break
+            start = end
+            block *= 2
+        if next_anchor is None:
+            break
+        anchors.append(anchor)
+        expected_length = max(block_size, 2 * (next_anchor - anchor))
+        anchor = next_anchor
+
+    # Add the last segment if it's long enough
+    if times[-1] - times[anchor] >= min_duration:
+        anchors.append(anchor)
+
+    return timeline.select(np.array(anchors, dtype=np.int64))
@@ -0,0 +1,276 @@
+import os
+import glob
+import cv2
+import numpy as np
+import face_recognition
+
+# "auto" uses YuNet, then the res10 SSD, whichever has its model files present, and falls
+# back to the Haar cascade; "yunet", "ssd" or "haar" force one backend
+FACE_DETECTOR = os.environ.get("QARIO_FACE_DETECTOR", "auto")
+# OpenCV threads for YuNet inference; 0 keeps the process setting (1 in pool workers)
+YUNET_THREADS = int(os.environ.get("QARIO_YUNET_THREADS", "0"))
+
+# Smallest face to find, as a fraction of frame height; HOG runs on a copy scaled so such
+# a face is still HOG_FACE_SIZE pixels tall
+MIN_FACE_FRACTION = float(os.environ.get("QARIO_HOG_MIN_FACE", "0.15"))
+# Roughly the smallest face dlib's HOG detector finds without upsampling
+HOG_FACE_SIZE = 80
+# Re-run HOG on a crop around each face to recover full-resolution box edges
+HOG_REFINE = os.environ.get("QARIO_HOG_REFINE", "0") == "1"
+
+# backend/models ships deploy.prototxt; model_management.py downloads into backend/src/models
+MODEL_DIRS = [
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), 'models'),
+    os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'models'),
+]
+
+SSD_PROTOTXT = 'deploy.prototxt'
+SSD_WEIGHTS = 'res10_300x300_ssd_iter_140000.caffemodel'
+SSD_INPUT_SIZE = (300, 300)
+# BGR channel means the res10 network was trained with
+SSD_MEAN = (104.0, 177.0, 123.0)
+
+YUNET_REPO = 'opencv/opencv_zoo'
+YUNET_MODEL = 'face_detection_yunet_2023mar.onnx'
+
+
+def find_model(filename):
+    """First path to filename in MODEL_DIRS, or None"""
+    for models_dir in MODEL_DIRS:
+        path = os.path.join(models_dir, filename)
+        if os.path.exists(path):
+            return path
+    return None
+
+def find_hf_model(repo_id, filename):
+    """
+    Path to a file fetched with hf_hub_download(cache_dir=models_dir), i.e.
+    models--<org>--<name>/snapshots/<revision>/<filename>, or a plain copy in a models dir
+    """
+    for models_dir in MODEL_DIRS:
+        pattern = os.path.join(models_dir, 'models--' + repo_id.replace('/', '--'), 'snapshots', '*', filename)
+        matches = sorted(glob.glob(pattern))
+        if matches:
+            return matches[-1]
+    return find_model(filename)
+
+# Loaded once per process (see get_face_cascade / get_ssd_net / get_yunet)
+_face_cascade = None
+_ssd_net = None
+_backend = None
+# One YuNet instance per input resolution, so cameras with different sizes don't reset each other
+_yunet_detectors = {}
+
+def get_face_cascade():
+    global _face_cascade
+    if _face_cascade is None:
+        _face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+    return _face_cascade
+
+def detect_faces_fast(frame):
+    small_frame = cv2.resize(frame, (0, 0), fx=0.25, fy=0.25)
+    gray_frame = cv2.cvtColor(small_frame, cv2.COLOR_RGB2GRAY)
+
+    face_cascade = get_face_cascade()
+    faces = face_cascade.detectMultiScale(gray_frame, 1.1, 4)
+
+    face_locations = []
+    for (x, y, w, h) in faces:
+        face_locations.append(
+            (int(y*4), int((x+w)*4), int((y+h)*4), int(x*4))
+        )
+
+    return face_locations
+
+def get_ssd_net():
+    """res10 SSD face detector, or None when the prototxt or weights are missing"""
+    global _ssd_net
+    if _ssd_net is None:
+        prototxt, weights = find_model(SSD_PROTOTXT), find_model(SSD_WEIGHTS)
+        if prototxt is None or weights is None:
+            return None
+        _ssd_net = cv2.dnn.readNetFromCaffe(prototxt, weights)
+    return _ssd_net
+
+def get_yunet(width, height):
+    """YuNet face detector with its input size set for width x height frames, or None when the model is missing"""
+    size = (int(width), int(height))
+    if size not in _yunet_detectors:
+        model = find_hf_model(YUNET_REPO, YUNET_MODEL)
+        if model is None:
+            return None
+        if YUNET_THREADS > 0:
+            cv2.setNumThreads(YUNET_THREADS)
+        _yunet_detectors[size] = cv2.FaceDetectorYN.create(model, "", size, 0.6, 0.3, 50)
+    return _yunet_detectors[size]
+
+def detector_backend():
+    """Name of the face detector backend in use ("yunet", "ssd" or "haar"), resolved once per process"""
+    global _backend
+    if _backend is None:
+        if FACE_DETECTOR in ("auto", "yunet") and find_hf_model(YUNET_REPO, YUNET_MODEL) is not None:
+            _backend = "yunet"
+        elif FACE_DETECTOR in ("auto", "ssd") and get_ssd_net() is not None:
+            _backend = "ssd"
+        elif FACE_DETECTOR in ("auto", "haar"):
+            _backend = "haar"
+        else:
+            raise FileNotFoundError(f"Model files for face detector '{FACE_DETECTOR}' not found in {MODEL_DIRS}")
+    return _backend
+
+def detect_faces_ssd_batch(frames, confidence_threshold=0.5, rgb=True):
+    """
+    Run the res10 SSD on several frames (of any sizes) in one forward pass.
+    Returns one list of (top, right, bottom, left) boxes in pixel coordinates per frame,
+    the same format as detect_faces_fast.
+    rgb: frames are RGB (moviepy, face_recognition); pass False for OpenCV BGR frames
+    """
+    if not frames:
+        return []
+    net = get_ssd_net()
+    blob = cv2.dnn.blobFromImages(frames, 1.0, SSD_INPUT_SIZE, SSD_MEAN, swapRB=rgb, crop=False)
+    net.setInput(blob)
+    # (1, 1, detections, 7): image index, class, confidence, x1, y1, x2, y2 (normalized)
+    detections = net.forward().reshape(-1, 7)
+    detections = detections[detections[:, 2] >= confidence_threshold]
+
+    face_locations = [[] for _ in frames]
+    for image_id, _, _, x1, y1, x2, y2 in detections:
+        height, width = frames[int(image_id)].shape[:2]
+        left, right = np.clip([x1 * width, x2 * width], 0, width - 1).astype(int)
+        top, bottom = np.clip([y1 * height, y2 * height], 0, height - 1).astype(int)
+        if right > left and bottom > top:
+            face_locations[int(image_id)].append((int(top), int(right), int(bottom), int(left)))
+    return face_locations
+
+def detect_faces_yunet(frame, rgb=True):
+    """
+    YuNet faces in one frame as a list of ((top, right, bottom, left), landmarks), where
+    landmarks is a (5, 2) array: right eye, left eye, nose tip, right and left mouth corner
+    """
+    height, width = frame.shape[:2]
+    detector = get_yunet(width, height)
+    image = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR) if rgb else frame
+    _, faces = detector.detect(image)
+    if faces is None:
+        return []
+
+    results = []
+    for face in faces:
+        x, y, w, h = face[:4]
+        left, right = np.clip([x, x + w], 0, width - 1).astype(int)
+        top, bottom = np.clip([y, y + h], 0, height - 1).astype(int)
+        if right > left and bottom > top:
+            results.append(((int(top), int(right), int(bottom), int(left)), face[4:14].reshape(5, 2)))
+    return results
+
+def detect_faces_with_landmarks_batch(frames):
+    """
+    Faces in each of several RGB frames as lists of (box, landmarks); landmarks is None
+    for backends that don't produce them
+    """
+    backend = detector_backend()
+    if backend == "yunet":
+        return [detect_faces_yunet(frame) for frame in frames]
+    if backend == "ssd":
+        return [[(box, None) for box in boxes] for boxes in detect_faces_ssd_batch(frames)]
+    return [[(box, None) for box in detect_faces_fast(frame)] for frame in frames]
+
+def hog_scale(frame_height, min_face_fraction=MIN_FACE_FRACTION):
+    """Downscale factor for HOG detection, never above 1"""
+    return min(1.0, HOG_FACE_SIZE / max(1.0, frame_height * min_face_fraction))
+
+def refine_face(image, face_location, margin=0.4):
+    """
+    Re-detect one face on a crop around its coarse box, scaled so the face is about twice
+    HOG_FACE_SIZE. Returns the refined (top, right, bottom, left), or the input box when
+    HOG finds nothing in the crop.
+    """
+    top, right, bottom, left = face_location
+    height, width = image.shape[:2]
+    pad_y, pad_x = int((bottom - top) * margin), int((right - left) * margin)
+    y0, y1 = max(0, top - pad_y), min(height, bottom + pad_y)
+    x0, x1 = max(0, left - pad_x), min(width, right + pad_x)
+    crop = image[y0:y1, x0:x1]
+    if crop.size == 0:
+        return face_location
+
+    scale = min(1.0, 2 * HOG_FACE_SIZE / max(1, bottom - top))
+    small = cv2.resize(crop, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1 else crop
+    found = face_recognition.face_locations(small, number_of_times_to_upsample=0, model="hog")
+    if not found:
+        return face_location
+    # Largest face in the crop is the one we came for
+    t, r, b, l = max(found, key=lambda box: (box[2] - box[0]) * (box[1] - box[3]))
+    return (y0 + int(t / scale), x0 + int(r / scale), y0 + int(b / scale), x0 + int(l / scale))
+
+def detect_faces_hog(image, scale=None, refine=HOG_REFINE):
+    """
+    HOG faces as (top, right, bottom, left) in full-resolution pixels. HOG cost grows with
+    pixel count, so detection runs on a copy downscaled by scale (hog_scale of the image
+    height when omitted) and the boxes are mapped back; refine re-detects each face on a
+    local crop for tighter edges.
+    """
+    if scale is None:
+        scale = hog_scale(image.shape[0])
+    if scale < 1:
+        small = cv2.resize(image, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        upsample = 0
+    else:
+        small = image
+        upsample = 1
+    height, width = image.shape[:2]
+    face_locations = []
+    for top, right, bottom, left in face_recognition.face_locations(small, number_of_times_to_upsample=upsample, model="hog"):
+        face_locations.append((min(height - 1, int(top / scale)), min(width - 1, int(right / scale)),
+                               min(height - 1, int(bottom / scale)), max(0, int(left / scale))))
+    if refine and scale < 1:
+        face_locations = [refine_face(image, face_location) for face_location in face_locations]
+    return face_locations
+
+def warm_up_detectors():
+    """Pool warmup: load the configured detector once per worker"""
+    backend = detector_backend()
+    if backend == "haar":
+        get_face_cascade()
+    elif backend == "ssd":
+        get_ssd_net()
+
+def mouth_region_bounds(face_location, landmarks=None):
+    """
+    (top, bottom, left, right) of the mouth region of a face. With 5-point landmarks
+    (YuNet) the region is built around the real mouth corners; otherwise it falls back
+    to fixed proportions of the face box.
+    """
+    top, right, bottom, left = face_location
+    if landmarks is None:
+        return (top + int((bottom - top) * 0.65), bottom,
+                left + int((right - left) * 0.25), right - int((right - left) * 0.25))
+
+    mouth_right, mouth_left = landmarks[3], landmarks[4]
+    center_x, center_y = (mouth_right + mouth_left) / 2
+    half_width = max(abs(mouth_left[0] - mouth_right[0]) * 0.65, 2)
+    half_height = half_width * 0.6
+    return (max(top, int(center_y - half_height)), min(bottom, int(center_y + half_height)),
+            max(left, int(center_x - half_width)), min(right, int(center_x + half_width)))
+
+def mouth_patch(frame, face_location, landmarks=None, size=(24, 12)):
+    """
+    Mouth region of an RGB frame as a small zero-mean grayscale patch, so patches of the
+    same face can be compared across frames regardless of exposure. None if the region is empty.
+    """
+    top, bottom, left, right = mouth_region_bounds(face_location, landmarks)
+    region = frame[max(top, 0):bottom, max(left, 0):right]
+    if region.size == 0:
+        return None
+    gray = cv2.cvtColor(region, cv2.COLOR_RGB2GRAY)
+    patch = cv2.resize(gray, size, interpolation=cv2.INTER_AREA).astype(np.float32)
+    return patch - patch.mean()
+
+def mouth_variance(frame, face_location, landmarks=None):
+    """Grey-level variance of a face's mouth region in an RGB frame; an open, moving mouth varies more"""
+    top, bottom, left, right = mouth_region_bounds(face_location, landmarks)
+    mouth_region = frame[max(top, 0):bottom, max(left, 0):right]
+    if mouth_region.size == 0:
+        return 0
+    return np.var(cv2.cvtColor(mouth_region, cv2.COLOR_RGB2GRAY))
@@ -0,0 +1,190 @@
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+from detection_timeline import DetectionTimeline, iou_matrix
+
+
+class FaceTracker:
+    """
+    Assigns stable track IDs to faces across sampled frames.
+
+    Detections are associated with the live tracks by IoU using the Hungarian algorithm
+    (scipy's linear_sum_assignment), so two people sitting side by side keep their IDs
+    even when the detector lists them in a different order. Tracks unseen for longer
+    than max_gap seconds are dropped.
+
+    Each track also keeps a mouth-activity score: the mean absolute difference between
+    consecutive mouth patches of that face (see face_detectors.mouth_patch), averaged
+    over the last activity_window samples.
+    """
+
+    def __init__(self, iou_threshold=0.3, max_gap=1.0, activity_window=8):
+        self.iou_threshold = iou_threshold
+        self.max_gap = max_gap
+        self.activity_window = activity_window
+        self.next_id = 0
+        self.tracks = {}
+
+    def reset(self):
+        """Drop all live tracks (after a shot change); new faces get new IDs"""
+        self.tracks = {}
+
+    def _new_track(self, time, box, patch):
+        track_id = self.next_id
+        self.next_id += 1
+        self.tracks[track_id] = {"box": box, "last_time": time, "patch": patch, "activity": []}
+        return track_id
+
+    def update(self, time, boxes, patches):
+        """
+        boxes: (N, 4) x1, y1, x2, y2 of the faces in this sample; patches: N mouth patches (or None)
+        Returns (track_ids, activity) arrays aligned with boxes.
+        """
+        boxes = np.asarray(boxes, dtype=np.int32).reshape(-1, 4)
+        for track_id in [tid for tid, track in self.tracks.items() if time - track["last_time"] > self.max_gap]:
+            del self.tracks[track_id]
+
+        track_ids = np.full(len(boxes), -1, dtype=np.int32)
+        live_ids = list(self.tracks)
+        if live_ids and len(boxes):
+            overlap = iou_matrix([self.tracks[tid]["box"] for tid in live_ids], boxes)
+            rows, cols = linear_sum_assignment(-overlap)
+            for row, col in zip(rows, cols):
+                if overlap[row, col] >= self.iou_threshold:
+                    track_ids[col] = live_ids[row]
+
+        activity = np.zeros(len(boxes), dtype=np.float32)
+        for i, box in enumerate(boxes):
+            if track_ids[i] < 0:
+                track_ids[i] = self._new_track(time, box, patches[i])
+                continue
+            track = self.tracks[track_ids[i]]
+            if track["patch"] is not None and patches[i] is not None:
+                track["activity"].append(float(np.abs(patches[i] - track["patch"]).mean()))
+                del track["activity"][:-self.activity_window]
+            track.update(box=box, last_time=time, patch=patches[i])
+            activity[i] = np.mean(track["activity"]) if track["activity"] else 0.0
+        return track_ids, activity
+
+# Inner-lip points within a 20-point dlib mouth (68-point indices 60-67 minus 48)
+INNER_LIP_CORNERS = (12, 16)
+INNER_LIP_PAIRS = ((13, 19), (14, 18), (15, 17))
+
+def mouth_aspect_ratio(mouths, corners=INNER_LIP_CORNERS, pairs=INNER_LIP_PAIRS):
+    """
+    Inner-lip opening over mouth width for (..., points, 2) mouth landmarks; the defaults
+    index a 20-point dlib mouth, other landmark sets pass their own corner and pair indices
+    """
+    mouths = np.asarray(mouths, dtype=np.float32)
+    upper = mouths[..., [a for a, _ in pairs], :]
+    lower = mouths[..., [b for _, b in pairs], :]
+    opening = np.linalg.norm(upper - lower, axis=-1).mean(axis=-1)
+    width = np.linalg.norm(mouths[..., corners[0], :] - mouths[..., corners[1], :], axis=-1)
+    return opening / np.maximum(width, 1e-6)
+
+class MouthHistory:
+    """
+    Rolling window of mouth landmarks per track ID (see FaceTracker), so lip movement is
+    always measured against earlier samples of the same face. Movement is the variance
+    of the mouth aspect ratio over the window: a talking mouth keeps opening and closing,
+    a silent one holds still whatever its shape.
+    aspect_ratio: maps a (window, points, 2) stack of one track's mouths to ratios
+    (mouth_aspect_ratio for dlib mouths)
+    """
+
+    def __init__(self, window=4, aspect_ratio=mouth_aspect_ratio):
+        self.window = window
+        self.aspect_ratio = aspect_ratio
+        self.mouths = {}
+
+    def prune(self, live_ids):
+        """Forget tracks the tracker has dropped"""
+        for track_id in [tid for tid in self.mouths if tid not in live_ids]:
+            del self.mouths[track_id]
+
+    def update(self, track_ids, mouths):
+        """
+        Add this sample's mouth landmarks for track_ids. Returns the movement of each given
+        track (0 until it has two samples).
+        """
+        movement = np.zeros(len(track_ids), dtype=np.float32)
+        for i, (track_id, mouth) in enumerate(zip(track_ids, mouths)):
+            history = self.mouths.get(int(track_id))
+            mouth = np.asarray(mouth, dtype=np.float32)[None]
+            history = mouth if history is None else np.concatenate([history, mouth])[-self.window:]
+            self.mouths[int(track_id)] = history
+            if len(history) > 1:
+                movement[i] = np.var(self.aspect_ratio(history))
+        return movement
+
+def stitch_track_ids(shards, owned_from, iou_threshold=0.5):
+    """
+    Join tracked timelines of consecutive, overlapping time ranges (one FaceTracker each)
+    into one timeline with consistent track IDs.
+
+    owned_from: time each shard's own range starts. Its rows before that overlap the
+    previous shard and are only used for matching: a track takes the ID of the previous
+    shard's track whose boxes it overlaps at the most shared sample times. Unmatched
+    tracks get fresh IDs.
+    """
+    merged = []
+    previous = None
+    next_id = 0
+    for timeline, start in zip(shards, owned_from):
+        overlap = timeline.select(timeline.times < start)
+        own = timeline.select(timeline.times >= start)
+
+        mapping = {}
+        if previous is not None and len(overlap) and len(previous):
+            votes = {}
+            for time in np.unique(overlap.times):
+                ours = overlap.select(overlap.times == time)
+                theirs = previous.select(previous.times == time)
+                if not len(theirs):
+                    continue
+                overlap_iou = iou_matrix(ours.boxes, theirs.boxes)
+                rows, cols = linear_sum_assignment(-overlap_iou)
+                for row, col in zip(rows, cols):
+                    if overlap_iou[row, col] >= iou_threshold:
+                        pair = (int(ours.track_ids[row]), int(theirs.track_ids[col]))
+                        votes[pair] = votes.get(pair, 0) + 1
+            taken = set()
+            for (local_id, global_id), _ in sorted(votes.items(), key=lambda item: -item[1]):
+                if local_id not in mapping and global_id not in taken:
+                    mapping[local_id] = global_id
+                    taken.add(global_id)
+
+        for local_id in np.unique(own.track_ids).tolist():
+            if local_id not in mapping:
+                mapping[local_id] = next_id
+                next_id += 1
+        own.track_ids = np.array([mapping[tid] for tid in own.track_ids.tolist()], dtype=np.int32)
+        merged.append(own)
+        previous = own
+    return DetectionTimeline.concatenate(merged)
+
+def select_active_speaker(faces, switch_margin=1.25):
+    """
+    One detection per sample time from a tracked timeline of all faces (scores = mouth
+    activity): the face with the most mouth activity. The current speaker is kept
+    unless another track's activity beats it by switch_margin, so near-ties don't flip
+    the zoom back and forth. Returns a DetectionTimeline.
+    """
+    if not len(faces):
+        return DetectionTimeline()
+
+    # Rows are grouped by time; split into per-sample groups once
+    group_starts = np.flatnonzero(np.r_[True, np.diff(faces.times) != 0])
+    group_ends = np.r_[group_starts[1:], len(faces)]
+
+    chosen = []
+    current_track = None
+    for start, end in zip(group_starts, group_ends):
+        scores = faces.scores[start:end]
+        best = start + int(np.argmax(scores))
+        if current_track is not None:
+            same = np.flatnonzero(faces.track_ids[start:end] == current_track)
+            if same.size and faces.scores[best] <= switch_margin * faces.scores[start + same[0]]:
+                best = start + same[0]
+        current_track = faces.track_ids[best]
+        chosen.append(best)
+    return faces.select(np.array(chosen, dtype=np.int64))
@@ -0,0 +1,87 @@
+import cv2
+import numpy as np
+
+
+class FrameChangeGate:
+    """
+    Decides whether a sampled frame needs a fresh face detection.
+
+    Each frame is reduced to a tiny grayscale thumbnail and compared (mean absolute
+    difference) with the thumbnail of the last frame that was run through the detector.
+    Mouth regions of that reference frame are masked out, since talking is expected to
+    change them while the faces stay put. Below the threshold the previous boxes are
+    still valid; a refresh is forced every refresh_interval frames so slow drift is
+    picked up.
+
+    The mask belongs to the reference: after a frame becomes the reference, comparisons
+    wait (needs_detection returns None) until the consumer reports that frame's mouth
+    regions with set_mouth_regions. Use with frame_pipeline.gated_imap, which delivers
+    earlier results until the gate can decide.
+    """
+
+    def __init__(self, threshold=3.0, thumb_width=64, refresh_interval=8):
+        self.threshold = threshold
+        self.thumb_width = thumb_width
+        self.refresh_interval = refresh_interval
+        self.reference = None
+        self.since_refresh = 0
+        self.frames = 0
+        self.detections = 0
+        # Key of the reference frame, and its (top, bottom, left, right) mouth regions in
+        # frame pixels once the consumer has them (None while its detection is pending)
+        self.reference_key = None
+        self.mouth_regions = None
+
+    def thumbnail(self, frame):
+        height, width = frame.shape[:2]
+        thumb_height = max(1, round(height * self.thumb_width / width))
+        small = cv2.resize(frame, (self.thumb_width, thumb_height), interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(small, cv2.COLOR_RGB2GRAY).astype(np.float32)
+
+    def changed(self, thumb, frame_shape):
+        mask = np.ones(thumb.shape, dtype=bool)
+        scale = thumb.shape[1] / frame_shape[1]
+        for top, bottom, left, right in self.mouth_regions:
+            mask[int(top * scale):int(np.ceil(bottom * scale)), int(left * scale):int(np.ceil(right * scale))] = False
+        if not mask.any():
+            return True
+        return np.abs(thumb - self.reference)[mask].mean() > self.threshold
+
+    def set_mouth_regions(self, key, regions):
+        """Mouth regions of the frame detected under key; ignored if it is no longer the reference"""
+        if key == self.reference_key:
+            self.mouth_regions = list(regions)
+
+    def needs_detection(self, frame, key=None, force=False):
+        """
+        True if frame (RGB) must go through the detector, False if the reference's faces
+        still hold, None if that can't be told until the reference's mouth regions are
+        set. Decisions are counted for call_rate.
+        key: identifies the frame in set_mouth_regions if it becomes the reference
+        force: detect regardless of change (e.g. the first frame of a new shot)
+        """
+        thumb = self.thumbnail(frame)
+        detect = (force
+                  or self.reference is None
+                  or self.reference.shape != thumb.shape
+                  or self.since_refresh + 1 >= self.refresh_interval)
+        if not detect:
+            if self.mouth_regions is None:
+                return None
+            detect = self.changed(thumb, frame.shape)
+
+        self.frames += 1
+        if detect:
+            self.reference = thumb
+            self.reference_key = key
+            self.mouth_regions = None
+            self.since_refresh = 0
+            self.detections += 1
+        else:
+            self.since_refresh += 1
+        return detect
+
+    @property
+    def call_rate(self):
+        """Fraction of frames that went through the detector"""
+        return self.detections / self.frames if self.frames else 0.0
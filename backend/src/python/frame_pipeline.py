@@ -0,0 +1,261 @@
+import os
+import atexit
+import queue
+import threading
+from collections import OrderedDict, deque
+import cv2
+import numpy as np
+from multiprocessing import Pool, cpu_count, resource_tracker, shared_memory
+from frame_sampler import iter_sampled_frames, iter_selected_frames
+
+
+def gated_imap(pool, func, iterable, gate, max_pending):
+    """
+    Ordered detection over a lazy producer that only sends items for which gate(item) is
+    true to the workers, holding at most max_pending items that haven't been yielded.
+
+    Yields (item, result) for every item in input order; result is None for items the
+    gate held back, which the consumer handles itself (all earlier results have been
+    yielded by then, so it can reuse them). The producer, gate and consumer all run in
+    the calling thread, so the gate sees exactly the state the consumer has applied so
+    far. gate may return None when it can't decide before an earlier item's result is
+    in (e.g. the faces of its reference frame): earlier items are then yielded until it
+    can. Held items keep their ring slots, so max_pending must be below the ring size.
+    """
+    pending = deque()
+
+    def collect():
+        item, result = pending.popleft()
+        return item, (result.get() if result is not None else None)
+
+    for item in iterable:
+        send = gate(item)
+        while send is None:
+            if not pending:
+                raise RuntimeError("gate is waiting for a result that was never delivered")
+            yield collect()
+            send = gate(item)
+        pending.append((item, pool.apply_async(func, (item,)) if send else None))
+
+        # Hand back everything already done; block only when too many items are held
+        while pending and (pending[0][1] is None or pending[0][1].ready()):
+            yield collect()
+        while len(pending) > max_pending:
+            yield collect()
+    while pending:
+        yield collect()
+
+# Workers in the shared pool; callers with less parallel work submit fewer tasks rather
+# than asking for a smaller pool, so the warm pool is never torn down to be resized
+POOL_PROCESSES = cpu_count()
+
+# Process-wide warm pool (see get_pool) and the (cv_threads, warmups) its workers started with
+_pool = None
+_pool_config = None
+
+def init_worker(cv_threads, warmups):
+    """
+    Pool initializer: pin OpenCV's internal threads so N workers don't each spawn
+    a thread per core, and load detector models once per process
+    """
+    cv2.setNumThreads(cv_threads)
+    for warmup in warmups:
+        warmup()
+
+def get_pool(cv_threads=1, warmups=()):
+    """
+    Long-lived pool of POOL_PROCESSES workers shared by every video processed in this process.
+
+    Created on first use (warmups are module-level functions run once in each worker,
+    e.g. loading a detector) and kept until shutdown_pool() or interpreter exit, so
+    batch runs and a long-lived Python worker pay the start-up cost once. Warmups only
+    run when a worker starts, so a request for warmups the pool hasn't run (or for other
+    cv_threads) replaces it with one that runs the earlier warmups too. The
+    shared-memory resource tracker is started before forking so workers share it;
+    otherwise each worker reports the parent's ring segments as leaked on exit.
+    """
+    global _pool, _pool_config
+    warmups = tuple(warmups)
+    if _pool is not None:
+        pool_threads, pool_warmups = _pool_config
+        if pool_threads == cv_threads and set(warmups) <= set(pool_warmups):
+            return _pool
+        warmups = pool_warmups + tuple(warmup for warmup in warmups if warmup not in pool_warmups)
+        shutdown_pool()
+    resource_tracker.ensure_running()
+    _pool = Pool(processes=POOL_PROCESSES, initializer=init_worker, initargs=(cv_threads, warmups))
+    _pool_config = (cv_threads, warmups)
+    return _pool
+
+def shutdown_pool(terminate=False):
+    """
+    Stops the warm pool. A clean shutdown lets workers finish their tasks; terminate
+    kills them, for error paths where a worker may still be busy on a task nobody will
+    collect and join() would wait for it.
+    """
+    global _pool, _pool_config
+    if _pool is not None:
+        if terminate:
+            _pool.terminate()
+        else:
+            _pool.close()
+        _pool.join()
+        _pool = None
+        _pool_config = None
+
+atexit.register(shutdown_pool)
+
+# Share of the free space in /dev/shm one job's frame rings may take, so concurrent jobs
+# still find room; QARIO_SHM_MB sets a fixed budget in MB instead
+SHM_FREE_FRACTION = 0.5
+SHM_BUDGET_MB = os.environ.get("QARIO_SHM_MB")
+SHM_PATH = "/dev/shm"
+
+def shm_budget():
+    """Bytes of shared memory a job's rings may use now, or None when it can't be measured"""
+    if SHM_BUDGET_MB is not None:
+        return int(float(SHM_BUDGET_MB) * 1024 * 1024)
+    try:
+        stats = os.statvfs(SHM_PATH)
+    except OSError:
+        return None
+    return int(stats.f_bavail * stats.f_frsize * SHM_FREE_FRACTION)
+
+def make_frame_ring(shape, slots, rings=1, dtype=np.uint8):
+    """
+    Ring of slots frames of shape, one of `rings` made together for a job. The frames live in
+    shared memory when the budget (see shm_budget) has room for all rings at full size;
+    otherwise they stay in process memory and are pickled to the workers. A smaller ring
+    would bound the frames in flight and so serialize detection; Docker's default 64 MB
+    /dev/shm only holds a few 1080p frames, so small containers take the pickled path.
+    """
+    frame_bytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+    budget = shm_budget()
+    shared = budget is None or slots * frame_bytes * rings <= budget
+    return SharedFrameRing(slots, shape, dtype, shared=shared)
+
+class SharedFrameRing:
+    """
+    Fixed-shape frame slots in one multiprocessing.shared_memory block.
+
+    The producer decodes straight into a free slot and sends workers only the ring
+    spec and slot index; workers map the same block (see attach_frame) instead of
+    receiving a pickled copy of every frame. Slots go back to the free list when
+    the consumer has collected the slot's result. With shared=False the slots are
+    ordinary process memory and ref() hands out the frame itself, to be pickled.
+    """
+
+    def __init__(self, slots, shape, dtype=np.uint8, shared=True):
+        self.slots = slots
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.shared = shared
+        if shared:
+            size = slots * int(np.prod(self.shape)) * self.dtype.itemsize
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+            self.frames = np.ndarray((slots,) + self.shape, dtype=self.dtype, buffer=self.shm.buf)
+            self.spec = (self.shm.name, slots, self.shape, self.dtype.str)
+        else:
+            self.shm = None
+            self.frames = np.empty((slots,) + self.shape, dtype=self.dtype)
+            self.spec = None
+        self._free = queue.Queue()
+        for slot in range(slots):
+            self._free.put(slot)
+        self._closed = threading.Event()
+
+    def ref(self, slot):
+        """What a pool task carries for a slot; workers turn it back into a frame with frame_of"""
+        return (self.spec, slot) if self.shared else self.frames[slot]
+
+    def acquire(self):
+        """Block until a slot is free; returns None once the ring is closed"""
+        while not self._closed.is_set():
+            try:
+                return self._free.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return None
+
+    def release(self, slot):
+        self._free.put(slot)
+
+    def close(self):
+        self._closed.set()
+        self.frames = None
+        if self.shm is None:
+            return
+        self.shm.unlink()
+        try:
+            self.shm.close()
+        except BufferError:
+            # A producer still holds a slot view; the mapping goes away with it
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+# Worker-side mappings of rings, keyed by shared memory name, most recently used last
+_attached_rings = OrderedDict()
+# Enough for the three camera rings used together in sync_detect_swap
+MAX_ATTACHED_RINGS = 4
+
+def attach_frame(spec, slot):
+    """Worker-side view of one ring slot (the mapping is opened once per process)"""
+    name, slots, shape, dtype = spec
+    if name in _attached_rings:
+        _attached_rings.move_to_end(name)
+    else:
+        # Rings of finished jobs fall off the end so long-lived workers don't accumulate mappings
+        while len(_attached_rings) >= MAX_ATTACHED_RINGS:
+            _, (old_shm, _) = _attached_rings.popitem(last=False)
+            try:
+                old_shm.close()
+            except BufferError:
+                pass
+        shm = shared_memory.SharedMemory(name=name)
+        frames = np.ndarray((slots,) + tuple(shape), dtype=np.dtype(dtype), buffer=shm.buf)
+        _attached_rings[name] = (shm, frames)
+    return _attached_rings[name][1][slot]
+
+def frame_of(ref):
+    """Worker-side frame of a SharedFrameRing.ref: the pickled frame itself, or a shared-memory view"""
+    if isinstance(ref, np.ndarray):
+        return ref
+    return attach_frame(*ref)
+
+def sample_into_ring(ring, video_path, step, start_frame=0, end_frame=None, color_conversion=None,
+                     frame_numbers=None):
+    """
+    Yield (slot, frame_number) for every step-th frame, decoded directly into ring slots.
+    color_conversion: optional cv2.COLOR_* code applied in place (e.g. BGR to RGB)
+    frame_numbers: explicit ascending frames to sample instead of the step grid
+    Stops when the ring is closed; the consumer must release each slot after use.
+    """
+    acquired = []
+
+    def next_buffer():
+        slot = ring.acquire()
+        acquired.append(slot)
+        return ring.frames[slot] if slot is not None else None
+
+    if frame_numbers is not None:
+        frames = iter_selected_frames(video_path, frame_numbers, into=next_buffer)
+    else:
+        frames = iter_sampled_frames(video_path, step, start_frame, end_frame, into=next_buffer)
+
+    for frame_number, frame in frames:
+        slot = acquired.pop()
+        if slot is None:
+            return
+        target = ring.frames[slot]
+        if not np.shares_memory(frame, target):
+            # OpenCV reallocated (unexpected frame size); copying raises if the shape differs
+            target[...] = frame
+        if color_conversion is not None:
+            cv2.cvtColor(target, color_conversion, dst=target)
+        yield slot, frame_number
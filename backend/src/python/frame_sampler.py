@@ -0,0 +1,98 @@
+import cv2
+
+
+def sample_step(fps, samples_per_second):
+    """Frame stride for a target sampling rate (never below one frame)"""
+    return max(1, int(fps / samples_per_second))
+
+def iter_sampled_frames(video_path, step, start_frame=0, end_frame=None, into=None):
+    """
+    Walk a video once and yield (frame_number, bgr_frame) for every step-th frame.
+    into: optional callable returning the array to decode the next sampled frame into
+    (e.g. a shared-memory ring slot); by default OpenCV allocates a new frame.
+
+    Skipped frames are only grab()bed and sampled ones retrieve()d, so the whole
+    sampling pass costs one linear decode. Seeking with CAP_PROP_POS_FRAMES before
+    every read instead makes H.264 decode from the previous keyframe for each sample.
+    The only seek is to start_frame, when given.
+    """
+    cap = cv2.VideoCapture(video_path)
+    try:
+        if start_frame > 0:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+
+        frame_number = start_frame
+        while end_frame is None or frame_number < end_frame:
+            if not cap.grab():
+                break
+            if (frame_number - start_frame) % step == 0:
+                ret, frame = cap.retrieve(into() if into is not None else None)
+                if not ret:
+                    break
+                yield frame_number, frame
+            frame_number += 1
+    finally:
+        cap.release()
+
+def iter_selected_frames(video_path, frame_numbers, into=None):
+    """
+    Like iter_sampled_frames, but for an ascending list of frame numbers (e.g. a few per
+    shot): one linear pass that only retrieve()s the wanted frames.
+    """
+    wanted = sorted(set(int(n) for n in frame_numbers))
+    if not wanted:
+        return
+    cap = cv2.VideoCapture(video_path)
+    try:
+        frame_number = 0
+        for target in wanted:
+            while frame_number < target:
+                if not cap.grab():
+                    return
+                frame_number += 1
+            if not cap.grab():
+                return
+            ret, frame = cap.retrieve(into() if into is not None else None)
+            if not ret:
+                return
+            yield target, frame
+            frame_number += 1
+    finally:
+        cap.release()
+
+def frame_shape(video_path):
+    """Shape of decoded frames as OpenCV delivers them (after any rotation), from one decode"""
+    cap = cv2.VideoCapture(video_path)
+    try:
+        ret, frame = cap.read()
+        if not ret:
+            raise ValueError(f"Could not decode a frame from {video_path}")
+        return frame.shape
+    finally:
+        cap.release()
+
+def read_frames_at(video_path, frame_numbers, max_forward_gap=64):
+    """
+    Decode specific frames; returns {frame_number: bgr_frame}.
+    Targets are visited in ascending order in one pass: short gaps are crossed with
+    grab() (cheaper than a seek, which decodes from the previous keyframe), longer
+    ones with a single CAP_PROP_POS_FRAMES seek.
+    """
+    frames = {}
+    cap = cv2.VideoCapture(video_path)
+    try:
+        position = 0
+        for target in sorted(set(int(n) for n in frame_numbers)):
+            if target < position or target - position > max_forward_gap:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, target)
+                position = target
+            while position < target and cap.grab():
+                position += 1
+            ret, frame = cap.read()
+            if not ret:
+                break
+            frames[target] = frame
+            position = target + 1
+    finally:
+        cap.release()
+    return frames
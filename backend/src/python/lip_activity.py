@@ -0,0 +1,168 @@
+"""
+Lip-activity backends behind one interface.
+
+Each backend is created per video stream and fed frames in order:
+
+    activity = make_lip_activity("mediapipe")
+    for time, frame in frames:
+        for face_location, track_id, score in activity.measure(frame, time):
+            ...
+
+measure(frame, time, faces=None, landmarks=None) takes an RGB frame, its time in seconds
+and optionally the (top, right, bottom, left) faces already found in it (with their
+5-point landmarks when the detector has them), and returns
+[(face_location, track_id, score)]: track IDs follow each face across frames and a
+higher score means more lip movement. Scores are only comparable within one backend.
+Backends with finds_faces set detect their own faces and ignore the ones passed in, so
+pipelines can skip their detector.
+
+The pipelines pick a backend with QARIO_LIP_BACKEND (see LIP_BACKEND_ENV):
+
+- "dlib": speaker_detection.py's default; 68-point mouth landmarks on known boxes,
+  movement is the variance of the mouth aspect ratio per tracked face
+- "variance": sync_detect_swap.py's default; grey-level variance of each mouth region,
+  from the frame alone
+- "mediapipe": MediaPipe Face Mesh in tracking mode (landmarks are followed from frame to
+  frame instead of detected again); mouth aspect ratio from the inner-lip landmarks
+"""
+import os
+import numpy as np
+import dlib
+import face_recognition
+from face_detectors import detect_faces_fast, detect_faces_hog, mouth_variance
+from face_tracking import FaceTracker, MouthHistory, mouth_aspect_ratio
+
+# Environment variable that overrides each pipeline's default backend
+LIP_BACKEND_ENV = "QARIO_LIP_BACKEND"
+
+# Points 48-67 of dlib's 68-point model: outer lip 48-59, inner lip 60-67
+MOUTH_POINTS = range(48, 68)
+
+# Face Mesh inner-lip points, ordered so the mouth corners are 0 and 4 and each upper
+# point i faces lower point 8 - i (13/14 is the centre of the lips)
+MESH_MOUTH_POINTS = (78, 82, 13, 312, 308, 317, 14, 87)
+MESH_LIP_CORNERS = (0, 4)
+MESH_LIP_PAIRS = ((1, 7), (2, 6), (3, 5))
+
+
+def mouth_landmarks(image, face_locations):
+    """
+    Mouth landmarks of already-detected faces as (20, 2) float32 arrays, aligned with
+    face_locations. The 68-point predictor runs once per known box on the full frame;
+    unlike face_recognition.face_landmarks without locations, nothing is re-detected.
+    """
+    predictor = face_recognition.api.pose_predictor_68_point
+    mouths = []
+    for top, right, bottom, left in face_locations:
+        shape = predictor(image, dlib.rectangle(int(left), int(top), int(right), int(bottom)))
+        mouths.append(np.array([(shape.part(i).x, shape.part(i).y) for i in MOUTH_POINTS], dtype=np.float32))
+    return mouths
+
+def mesh_mouth_aspect_ratio(mouths):
+    """mouth_aspect_ratio for (..., 8, 2) MESH_MOUTH_POINTS arrays"""
+    return mouth_aspect_ratio(mouths, MESH_LIP_CORNERS, MESH_LIP_PAIRS)
+
+def _track(tracker, time, face_locations):
+    """Track IDs for this frame's faces"""
+    boxes = [(left, top, right, bottom) for top, right, bottom, left in face_locations]
+    track_ids, _ = tracker.update(time, boxes, [None] * len(boxes))
+    return track_ids
+
+class DlibLipActivity:
+    """Faces default to the pipeline's downscaled HOG detector (see detect_faces_hog)"""
+    name = "dlib"
+    finds_faces = False
+
+    def __init__(self, window=4, max_gap=1.0):
+        self.tracker = FaceTracker(max_gap=max_gap)
+        self.history = MouthHistory(window=window)
+
+    def measure(self, frame, time, faces=None, landmarks=None):
+        if faces is None:
+            faces = detect_faces_hog(frame)
+        track_ids = _track(self.tracker, time, faces)
+        self.history.prune(self.tracker.tracks)
+        movement = self.history.update(track_ids, mouth_landmarks(frame, faces))
+        return list(zip(faces, track_ids.tolist(), movement.tolist()))
+
+    def close(self):
+        pass
+
+class VarianceLipActivity:
+    """Scores each frame on its own; window is accepted for a uniform constructor and unused"""
+    name = "variance"
+    finds_faces = False
+
+    def __init__(self, window=None, max_gap=1.0):
+        self.tracker = FaceTracker(max_gap=max_gap)
+
+    def measure(self, frame, time, faces=None, landmarks=None):
+        if faces is None:
+            faces = detect_faces_fast(frame)
+        if landmarks is None:
+            landmarks = [None] * len(faces)
+        track_ids = _track(self.tracker, time, faces)
+        return [(face_location, track_id, float(mouth_variance(frame, face_location, face_landmarks)))
+                for face_location, track_id, face_landmarks in zip(faces, track_ids.tolist(), landmarks)]
+
+    def close(self):
+        pass
+
+class MediaPipeLipActivity:
+    """
+    Face Mesh finds and tracks its own faces, so faces passed to measure are ignored.
+    Frames must come from one stream in order: the mesh of the previous frame seeds the
+    next, and detection only re-runs when tracking is lost.
+    """
+    name = "mediapipe"
+    finds_faces = True
+
+    def __init__(self, window=4, max_gap=1.0, max_faces=4):
+        import mediapipe as mp
+        self.mesh = mp.solutions.face_mesh.FaceMesh(
+            static_image_mode=False,
+            max_num_faces=max_faces,
+            refine_landmarks=False,
+            min_detection_confidence=0.5,
+            min_tracking_confidence=0.5
+        )
+        self.tracker = FaceTracker(max_gap=max_gap)
+        self.history = MouthHistory(window=window, aspect_ratio=mesh_mouth_aspect_ratio)
+
+    def measure(self, frame, time, faces=None, landmarks=None):
+        height, width = frame.shape[:2]
+        results = self.mesh.process(frame)
+        if not results.multi_face_landmarks:
+            return []
+
+        face_locations, mouths = [], []
+        for face in results.multi_face_landmarks:
+            points = np.array([(point.x, point.y) for point in face.landmark], dtype=np.float32) * (width, height)
+            left, top = np.clip(points.min(axis=0), 0, (width - 1, height - 1)).astype(int)
+            right, bottom = np.clip(points.max(axis=0), 0, (width - 1, height - 1)).astype(int)
+            face_locations.append((int(top), int(right), int(bottom), int(left)))
+            mouths.append(points[list(MESH_MOUTH_POINTS)])
+        track_ids = _track(self.tracker, time, face_locations)
+        self.history.prune(self.tracker.tracks)
+        movement = self.history.update(track_ids, mouths)
+        return list(zip(face_locations, track_ids.tolist(), movement.tolist()))
+
+    def close(self):
+        self.mesh.close()
+
+LIP_ACTIVITY_BACKENDS = {
+    "dlib": DlibLipActivity,
+    "variance": VarianceLipActivity,
+    "mediapipe": MediaPipeLipActivity,
+}
+
+def lip_backend(default):
+    """Backend name chosen by QARIO_LIP_BACKEND, or the pipeline's default"""
+    name = os.environ.get(LIP_BACKEND_ENV) or default
+    if name not in LIP_ACTIVITY_BACKENDS:
+        raise ValueError(f"Unknown {LIP_BACKEND_ENV} {name!r}; expected one of {', '.join(LIP_ACTIVITY_BACKENDS)}")
+    return name
+
+def make_lip_activity(name, **params):
+    """New per-stream lip-activity backend by name; raises ImportError when its package is missing"""
+    return LIP_ACTIVITY_BACKENDS[name](**params)
@@ -0,0 +1,105 @@
+import os
+import json
+import hashlib
+import subprocess
+from fractions import Fraction
+from stage_cache import load_cached_json, save_cached_json
+
+# Probes are also cached on disk under the "probe" kind; entries are keyed by path, size
+# and mtime so edits invalidate them
+_memory_cache = {}
+
+
+def parse_rate(rate):
+    """Parse an ffprobe rational such as '30000/1001' without eval; returns None for '0/0' or junk"""
+    try:
+        value = Fraction(rate)
+    except (TypeError, ValueError, ZeroDivisionError):
+        return None
+    return float(value) if value > 0 else None
+
+def _cache_key(path, count_frames):
+    stat = os.stat(path)
+    raw = f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}|{int(count_frames)}"
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+def _run_ffprobe(args):
+    cmd = ['ffprobe', '-v', 'error'] + args
+    result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout)
+
+def _count_frames(path):
+    """Exact frame count by demuxing the whole stream; only used when the container has no count"""
+    info = _run_ffprobe(['-select_streams', 'v:0', '-count_packets',
+                         '-show_entries', 'stream=nb_read_packets', '-of', 'json', path])
+    return int(info['streams'][0]['nb_read_packets'])
+
+def _probe(path, count_frames):
+    info = _run_ffprobe(['-show_entries',
+                         'stream=codec_type,width,height,r_frame_rate,avg_frame_rate,nb_frames,duration'
+                         ':format=duration',
+                         '-of', 'json', path])
+    streams = info.get('streams', [])
+    video = next((s for s in streams if s.get('codec_type') == 'video'), None)
+    audio = next((s for s in streams if s.get('codec_type') == 'audio'), None)
+
+    duration = info.get('format', {}).get('duration')
+    if duration is None and video is not None:
+        duration = video.get('duration')
+    duration = float(duration) if duration not in (None, 'N/A') else None
+
+    probe = {
+        'duration': duration,
+        'has_video': video is not None,
+        'has_audio': audio is not None,
+        'width': None,
+        'height': None,
+        'fps': None,
+        'total_frames': None,
+        'frames_counted': False
+    }
+    if video is None:
+        return probe
+
+    probe['width'] = int(video['width'])
+    probe['height'] = int(video['height'])
+    probe['fps'] = parse_rate(video.get('r_frame_rate')) or parse_rate(video.get('avg_frame_rate'))
+
+    nb_frames = video.get('nb_frames')
+    if nb_frames not in (None, 'N/A') and int(nb_frames) > 0:
+        # Read from the container index (e.g. the mp4 stts box), no demuxing needed
+        probe['total_frames'] = int(nb_frames)
+    elif count_frames:
+        probe['total_frames'] = _count_frames(path)
+        probe['frames_counted'] = True
+    elif duration is not None and probe['fps']:
+        probe['total_frames'] = int(round(duration * probe['fps']))
+    return probe
+
+def probe_media(path, count_frames=False):
+    """
+    Container metadata for a media file: duration, has_video/has_audio and, for video,
+    width, height, fps and total_frames.
+
+    Only headers are read. total_frames comes from the container when it records it,
+    otherwise it is estimated from duration * fps unless count_frames=True, which falls
+    back to demuxing the whole file. Results are cached in memory and on disk.
+    """
+    key = _cache_key(path, count_frames)
+    if key in _memory_cache:
+        return dict(_memory_cache[key])
+
+    probe = load_cached_json("probe", key)
+    if probe is None:
+        probe = _probe(path, count_frames)
+        save_cached_json("probe", key, probe)
+
+    _memory_cache[key] = probe
+    return dict(probe)
+
+def get_video_info(video_path):
+    """(width, height, total_frames, fps) of the first video stream"""
+    probe = probe_media(video_path)
+    if not probe['has_video']:
+        raise ValueError(f"No video stream in {video_path}")
+    return probe['width'], probe['height'], probe['total_frames'], probe['fps']
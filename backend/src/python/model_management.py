@@ -39,6 +39,15 @@ def download_models():
     hf_hub_download(repo_id="opencv/opencv_zoo", filename="face_detection_yunet_2023mar.onnx", cache_dir=models_dir)
     hf_hub_download(repo_id="microsoft/resnet-50", filename="pytorch_model.bin", cache_dir=models_dir)
 
+    # Download the res10 SSD face detector weights (deploy.prototxt ships in backend/models)
+    print("Downloading res10 SSD face detector weights...")
+    ssd_url = "https://raw.githubusercontent.com/opencv/opencv_3rdparty/dnn_samples_face_detector_20170830/res10_300x300_ssd_iter_140000.caffemodel"
+    response = requests.get(ssd_url)
+    ssd_path = os.path.join(models_dir, 'res10_300x300_ssd_iter_140000.caffemodel')
+    with open(ssd_path, 'wb') as f:
+        f.write(response.content)
+    print(f"Downloaded SSD face detector to {ssd_path}")
+
     # Download dlib's facial landmark predictor
     print("Downloading dlib's facial landmark predictor...")
     dlib_model_url = "https://github.com/italojs/facial-landmarks-recognition/raw/master/shape_predictor_68_face_landmarks.dat"
@@ -0,0 +1,113 @@
+import sys
+import json
+import time
+import resource
+
+# Progress events from hot loops are throttled to at most one per interval
+PROGRESS_INTERVAL = 1.0
+
+
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    """Peak resident set size in MB (ru_maxrss is KB on Linux, bytes on macOS)"""
+    peak = resource.getrusage(who).ru_maxrss
+    if sys.platform == "darwin":
+        return peak / (1024 * 1024)
+    return peak / 1024
+
+def emit(event, **fields):
+    """
+    Write one newline-delimited JSON event to stdout.
+    Every event has an "event" type and a "ts" timestamp; the Node bridge parses these line by line.
+    """
+    payload = {"event": event, "ts": round(time.time(), 3)}
+    payload.update(fields)
+    sys.stdout.write(json.dumps(payload, default=float) + "\n")
+    sys.stdout.flush()
+
+def report_progress(progress, **fields):
+    """Overall job progress in percent (0-100)"""
+    emit("progress", progress=progress, **fields)
+
+def report_error(message, **fields):
+    emit("error", message=message, **fields)
+
+def report_result(result):
+    """Final result of a script; the bridge resolves runPythonScript with it"""
+    emit("result", result=result)
+
+class Stage:
+    """
+    Timing and throughput for one pipeline stage.
+
+    Emits stage_start when started and stage_end (duration, frames per second,
+    real-time factor, peak RSS and any extra metrics) when finished. Hot loops call
+    add_frames() and progress(); the latter only emits at most once per PROGRESS_INTERVAL.
+    Usable as a context manager or with explicit start()/finish().
+    """
+
+    def __init__(self, name, media_duration=None, progress_range=None):
+        self.name = name
+        self.media_duration = media_duration
+        # Maps stage-local progress (0-1) onto a slice of overall job progress, e.g. (20, 70)
+        self.progress_range = progress_range
+        self.frames = 0
+        self.metrics = {}
+        self.started = None
+        self.duration = None
+        self._last_progress = 0.0
+
+    def start(self):
+        self.started = time.perf_counter()
+        self._last_progress = self.started
+        emit("stage_start", stage=self.name)
+        return self
+
+    def add_frames(self, count=1):
+        self.frames += count
+
+    def set_metric(self, key, value):
+        self.metrics[key] = value
+
+    def fps(self, elapsed=None):
+        elapsed = elapsed if elapsed is not None else time.perf_counter() - self.started
+        return self.frames / elapsed if elapsed > 0 else 0.0
+
+    def progress(self, fraction):
+        now = time.perf_counter()
+        if now - self._last_progress < PROGRESS_INTERVAL:
+            return
+        self._last_progress = now
+        fields = {"stage": self.name, "fraction": round(fraction, 4), "fps": round(self.fps(now - self.started), 2)}
+        if self.progress_range is not None:
+            low, high = self.progress_range
+            report_progress(low + int(fraction * (high - low)), **fields)
+        else:
+            emit("stage_progress", **fields)
+
+    def finish(self):
+        """Emit stage_end and return the stage duration in seconds"""
+        self.duration = time.perf_counter() - self.started
+        fields = {
+            "stage": self.name,
+            "duration": round(self.duration, 3),
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+            "children_peak_rss_mb": round(peak_rss_mb(resource.RUSAGE_CHILDREN), 1)
+        }
+        if self.frames:
+            fields["frames"] = self.frames
+            fields["fps"] = round(self.fps(self.duration), 2)
+        if self.media_duration and self.duration > 0:
+            # Seconds of media processed per wall-clock second
+            fields["realtime_factor"] = round(self.media_duration / self.duration, 3)
+        fields.update(self.metrics)
+        emit("stage_end", **fields)
+        return self.duration
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.set_metric("failed", True)
+        self.finish()
+        return False
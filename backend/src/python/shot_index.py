@@ -0,0 +1,112 @@
+import hashlib
+import subprocess
+import numpy as np
+from media_probe import probe_media
+from stage_cache import file_fingerprint, load_cached_json, save_cached_json
+
+THUMB_SIZE = (64, 36)
+HISTOGRAM_BINS = 16
+CHUNK_FRAMES = 1024
+
+
+def iter_thumbnail_chunks(video_path, size=THUMB_SIZE, chunk_frames=CHUNK_FRAMES):
+    """
+    Yield (n, height * width) uint8 arrays of tiny grayscale thumbnails of every frame,
+    decoded and scaled by ffmpeg in one pass (no full-size frames reach Python)
+    """
+    width, height = size
+    frame_bytes = width * height
+    cmd = [
+        'ffmpeg', '-v', 'error', '-i', video_path, '-an',
+        '-vf', f'scale={width}:{height},format=gray',
+        '-f', 'rawvideo', '-pix_fmt', 'gray', 'pipe:1'
+    ]
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+    try:
+        while True:
+            data = process.stdout.read(frame_bytes * chunk_frames)
+            count = len(data) // frame_bytes
+            if count == 0:
+                break
+            yield np.frombuffer(data[:count * frame_bytes], dtype=np.uint8).reshape(count, frame_bytes)
+    finally:
+        process.stdout.close()
+        returncode = process.wait()
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, cmd)
+
+def histograms(thumbs, bins=HISTOGRAM_BINS):
+    """Normalized gray histograms of a chunk of thumbnails, one row per frame"""
+    count, pixels = thumbs.shape
+    index = (thumbs.astype(np.int64) * bins // 256) + bins * np.arange(count)[:, None]
+    return np.bincount(index.ravel(), minlength=count * bins).reshape(count, bins) / pixels
+
+def build_shot_index(video_path, histogram_threshold=0.35, sad_threshold=20.0, min_shot_seconds=0.5):
+    """
+    Shot boundaries of a video from one pass over thumbnails.
+
+    A cut is where both the histogram distance (half the L1 difference, 0..1) and the
+    mean absolute pixel difference between consecutive thumbnails exceed their
+    thresholds; cuts closer than min_shot_seconds to the previous one (flashes, fast
+    wipes) are dropped. Returns {"fps", "total_frames", "cuts"}, where cuts are the first
+    frame numbers of every shot after the first.
+    """
+    fps = probe_media(video_path)['fps'] or 30.0
+    min_gap = max(1, int(round(min_shot_seconds * fps)))
+
+    candidates = []
+    previous_thumb, previous_hist = None, None
+    offset = 0
+    for thumbs in iter_thumbnail_chunks(video_path):
+        hists = histograms(thumbs)
+        if previous_thumb is not None:
+            thumbs_with_previous = np.vstack([previous_thumb[None], thumbs])
+            hists_with_previous = np.vstack([previous_hist[None], hists])
+        else:
+            thumbs_with_previous, hists_with_previous = thumbs, hists
+        sad = np.abs(np.diff(thumbs_with_previous.astype(np.int16), axis=0)).mean(axis=1)
+        hist_distance = np.abs(np.diff(hists_with_previous, axis=0)).sum(axis=1) / 2
+        first_frame = offset if previous_thumb is not None else offset + 1
+        cuts = np.flatnonzero((hist_distance > histogram_threshold) & (sad > sad_threshold))
+        candidates.extend((cuts + first_frame).tolist())
+
+        previous_thumb, previous_hist = thumbs[-1], hists[-1]
+        offset += len(thumbs)
+
+    cuts = []
+    for frame in candidates:
+        if frame - (cuts[-1] if cuts else 0) >= min_gap:
+            cuts.append(frame)
+    return {"fps": fps, "total_frames": offset, "cuts": cuts}
+
+def get_shot_index(video_path, **params):
+    """build_shot_index, persisted per input file so later stages and reruns reuse it"""
+    # Keyed by input content and detection parameters
+    raw = f"{file_fingerprint(video_path)}|{sorted(params.items())}"
+    key = hashlib.sha1(raw.encode()).hexdigest()
+    index = load_cached_json("shots", key)
+    if index is None:
+        index = build_shot_index(video_path, **params)
+        save_cached_json("shots", key, index)
+    return index
+
+def shot_ranges(index):
+    """[(start_frame, end_frame)] of every shot, end exclusive"""
+    starts = [0] + list(index["cuts"])
+    ends = list(index["cuts"]) + [index["total_frames"]]
+    return [(start, end) for start, end in zip(starts, ends) if end > start]
+
+def shot_of(index, frame_numbers):
+    """Shot number of each frame"""
+    return np.searchsorted(np.asarray(index["cuts"]), np.asarray(frame_numbers), side='right')
+
+def shot_sample_frames(index, max_interval, settle_frames=2):
+    """
+    Frames to analyse: one near the start of every shot (settle_frames in, past any
+    transition blur) and then every max_interval frames within long shots
+    """
+    frames = []
+    for start, end in shot_ranges(index):
+        first = start + min(settle_frames, (end - start - 1) // 2)
+        frames.extend(range(first, end, max(1, int(max_interval))))
+    return frames
@@ -1,11 +1,22 @@
 import cv2
 import numpy as np
-import face_recognition
 import os
 import sys
-import json
+import time
 import traceback
-import subprocess
+from multiprocessing import Manager
+from queue import Empty
+from media_probe import get_video_info
+from frame_sampler import iter_sampled_frames, sample_step
+from frame_pipeline import POOL_PROCESSES, get_pool, shutdown_pool
+from reporting import Stage, report_progress, report_error, report_result
+from crop_render import crop_track_from_segments, render_crop_track
+from detection_timeline import DetectionTimeline
+from face_detectors import detect_faces_hog, hog_scale
+from lip_activity import lip_backend, make_lip_activity
+from face_tracking import select_active_speaker, stitch_track_ids
+from speaker_identity import SpeakerIdentities, identify_tracks, speaker_records
+from adaptive_sampling import COARSE_SAMPLES_PER_SECOND, mouth_probe, refine_switches
 
 def print_flush(*args, **kwargs):
     print(*args, **kwargs)
@@ -13,153 +24,183 @@ def print_flush(*args, **kwargs):
 
 print_flush("Python script started")
 
-def detect_faces(image):
-    face_locations = face_recognition.face_locations(image, model="hog")
-    return face_locations
-
-def analyze_lip_movement(prev_landmarks, current_landmarks):
-    if not prev_landmarks or not current_landmarks:
-        return 0
-    
-    prev_mouth = np.mean(prev_landmarks['top_lip'] + prev_landmarks['bottom_lip'], axis=0)
-    current_mouth = np.mean(current_landmarks['top_lip'] + current_landmarks['bottom_lip'], axis=0)
-    return np.linalg.norm(current_mouth - prev_mouth)
-
-def get_video_info(video_path):
-    cmd = ['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-count_packets',
-           '-show_entries', 'stream=width,height,nb_read_packets,r_frame_rate',
-           '-of', 'json', video_path]
-    result = subprocess.run(cmd, capture_output=True, text=True)
-    info = json.loads(result.stdout)['streams'][0]
-    width = int(info['width'])
-    height = int(info['height'])
-    total_frames = int(info['nb_read_packets'])
-    fps = eval(info['r_frame_rate'])
-    return width, height, total_frames, fps
-
-def process_video(input_video, output_video):
+# Lip-activity backend (see lip_activity.py) unless QARIO_LIP_BACKEND picks another
+LIP_BACKEND = "dlib"
+
+# Time shards analysed in parallel; 0 picks one per CPU, capped so no shard is shorter
+# than MIN_SHARD_SECONDS, and 1 keeps everything in this process
+SPEAKER_SHARDS = int(os.environ.get("QARIO_SPEAKER_SHARDS", "0"))
+MIN_SHARD_SECONDS = 60
+# Each shard starts this early to warm up its tracker and mouth history; the overlap
+# also links its track IDs to the previous shard's
+SHARD_OVERLAP_SECONDS = 5
+
+def shard_ranges(total_frames, fps, step, shards):
+    """
+    [(warm_start, start, end)] frame ranges for time shards: each shard owns [start, end)
+    and is analysed from warm_start, SHARD_OVERLAP_SECONDS earlier. All bounds are
+    multiples of step, so overlapping shards sample the same frames.
+    """
+    samples = -(-total_frames // step)
+    per_shard = -(-samples // shards)
+    overlap = -(-int(SHARD_OVERLAP_SECONDS * fps) // step)
+    ranges = []
+    for first in range(0, samples, per_shard):
+        last = min(samples, first + per_shard)
+        ranges.append((max(0, first - overlap) * step, first * step, min(total_frames, last * step)))
+    return ranges
+
+def detect_range(task):
+    """
+    Track faces and their lip movement over one time range; runs in a pool worker per shard.
+    Returns (timeline of every tracked face from warm_start on, scored by movement, with
+    shard-local track IDs; frames analysed; HOG latencies; lip-activity latencies).
+    """
+    input_video, shard, (warm_start, start, end), step, fps, height, progress_queue = task
+    scale = hog_scale(height)
+    # Lip movement is compared per face across samples, never between two faces
+    activity = make_lip_activity(lip_backend(LIP_BACKEND), window=max(3, 4 * COARSE_SAMPLES_PER_SECOND),
+                                 max_gap=2.5 / COARSE_SAMPLES_PER_SECOND)
+    times, boxes, scores, track_ids = [], [], [], []
+    detect_latency, lip_latency = [], []
+    samples = max(1, -(-(end - warm_start) // step))
+    last_report = time.perf_counter()
+
+    try:
+        # One seek to the shard's first frame, then a linear walk
+        for i, (frame_number, frame) in enumerate(iter_sampled_frames(input_video, step, start_frame=warm_start, end_frame=end)):
+            if progress_queue is not None and time.perf_counter() - last_report >= 1.0:
+                last_report = time.perf_counter()
+                progress_queue.put((shard, i / samples))
+
+            rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            face_locations = None
+            if not activity.finds_faces:
+                started = time.perf_counter()
+                face_locations = detect_faces_hog(rgb_frame, scale)
+                detect_latency.append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            measured = activity.measure(rgb_frame, frame_number / fps, face_locations)
+            lip_latency.append(time.perf_counter() - started)
+
+            for (top, right, bottom, left), track_id, movement in measured:
+                times.append(frame_number / fps)
+                boxes.append((left, top, right, bottom))
+                scores.append(movement)
+                track_ids.append(track_id)
+    finally:
+        activity.close()
+
+    if progress_queue is not None:
+        progress_queue.put((shard, 1.0))
+    return DetectionTimeline(times, boxes, scores, track_ids), len(lip_latency), detect_latency, lip_latency
+
+def process_video(input_video, output_video, project_id=None):
     try:
         print_flush(f"Processing video: {input_video}")
         print_flush(f"Output video: {output_video}")
 
         # 10% progress for initialization
-        print_flush(json.dumps({"progress": 10}))
+        report_progress(10)
 
-        width, height, total_frames, fps = get_video_info(input_video)
+        with Stage("probe"):
+            width, height, total_frames, fps = get_video_info(input_video)
         print_flush(f"Video properties: FPS={fps}, Width={width}, Height={height}, Total Frames={total_frames}")
 
         # 15% progress after getting video info
-        print_flush(json.dumps({"progress": 15}))
-
-        cap = cv2.VideoCapture(input_video)
-        frames_to_process = range(0, total_frames, int(fps/2))  # Process 2 frames per second
-        speaking_frames = []
-        total_frames_to_process = len(frames_to_process)
-
-        prev_landmarks = None
-        for i, frame_number in enumerate(frames_to_process):
-            # Calculate progress from 20% to 70% during frame processing
-            progress = 20 + int((i / total_frames_to_process) * 50)
-            if i % 5 == 0:  # Update progress every 5 frames
-                print_flush(json.dumps({"progress": progress}))
-            
-            cap.set(cv2.CAP_PROP_POS_FRAMES, frame_number)
-            ret, frame = cap.read()
-            if not ret:
-                break
-
-            rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            face_locations = detect_faces(rgb_frame)
+        report_progress(15)
+
+        # Coarse pass; speaker switches are refined to the frame afterwards
+        step = sample_step(fps, COARSE_SAMPLES_PER_SECOND)
+        shards = SPEAKER_SHARDS or min(POOL_PROCESSES, max(1, int(total_frames / fps / MIN_SHARD_SECONDS)))
+        ranges = shard_ranges(total_frames, fps, step, shards)
+
+        # Progress from 20% to 70% during frame processing
+        detect_stage = Stage("detect", media_duration=total_frames / fps, progress_range=(20, 70)).start()
+        detect_stage.set_metric("hog_scale", round(hog_scale(height), 3))
+        detect_stage.set_metric("shards", len(ranges))
+        detect_stage.set_metric("lip_backend", lip_backend(LIP_BACKEND))
+        if len(ranges) > 1:
+            manager = Manager()
+            try:
+                progress_queue = manager.Queue()
+                tasks = [(input_video, shard, frame_range, step, fps, height, progress_queue)
+                         for shard, frame_range in enumerate(ranges)]
+                pending = get_pool().map_async(detect_range, tasks, chunksize=1)
+                # Overall progress is the mean over shards, each reporting its own fraction
+                fractions = [0.0] * len(ranges)
+                while not pending.ready():
+                    try:
+                        shard, fraction = progress_queue.get(timeout=0.5)
+                    except Empty:
+                        continue
+                    fractions[shard] = fraction
+                    detect_stage.progress(sum(fractions) / len(fractions))
+                results = pending.get()
+            finally:
+                manager.shutdown()
+        else:
+            results = [detect_range((input_video, 0, ranges[0], step, fps, height, None))] if ranges else []
+
+        faces = stitch_track_ids([timeline for timeline, _, _, _ in results],
+                                 [start / fps for _, start, _ in ranges])
+        detect_latency = [latency for _, _, latencies, _ in results for latency in latencies]
+        lip_latency = [latency for _, _, _, latencies in results for latency in latencies]
+        detect_stage.add_frames(sum(frames for _, frames, _, _ in results))
+
+        # Per sample, the face whose lips move most; samples where no lips move are dropped
+        speaking_frames = select_active_speaker(faces.select(faces.scores > 0), switch_margin=1.0)
+        detect_stage.set_metric("speaking_frames", len(speaking_frames))
+        if detect_latency:
+            # Per-frame HOG latency, to tune QARIO_HOG_MIN_FACE / QARIO_HOG_REFINE
+            detect_stage.set_metric("detect_ms_mean", round(1000 * float(np.mean(detect_latency)), 2))
+            detect_stage.set_metric("detect_ms_p95", round(1000 * float(np.percentile(detect_latency, 95)), 2))
+        if lip_latency:
+            detect_stage.set_metric("lip_ms_mean", round(1000 * float(np.mean(lip_latency)), 2))
+        detect_stage.finish()
+
+        # Who each track is: a few embeddings per track, matched against the project's known
+        # speakers; without a project there is nothing to match against or persist
+        speaker_of = {}
+        if project_id:
+            with Stage("identity") as stage:
+                identities = SpeakerIdentities(project_id)
+                speaker_of, embedded = identify_tracks(input_video, faces, fps, identities)
+                identities.save()
+                stage.set_metric("embedded_faces", embedded)
+                stage.set_metric("speakers", len(set(speaker_of.values())))
+
+        # Bisect between coarse samples where the speaking face changes, down to one frame
+        with Stage("refine") as stage:
+            speaking_frames, refined_frames = refine_switches(speaking_frames, fps, mouth_probe(input_video, fps))
+            stage.set_metric("refined_frames", refined_frames)
 
-            max_movement = 0
-            speaking_face = None
-
-            for face_location in face_locations:
-                top, right, bottom, left = face_location
-                face_image = rgb_frame[top:bottom, left:right]
-                landmarks = face_recognition.face_landmarks(face_image)
-
-                if landmarks and prev_landmarks:
-                    movement = analyze_lip_movement(prev_landmarks[0], landmarks[0])
-                    if movement > max_movement:
-                        max_movement = movement
-                        speaking_face = face_location
-
-                prev_landmarks = landmarks
+        # 75% progress after frame processing
+        report_progress(75)
 
-            if speaking_face:
-                speaking_frames.append({
-                    "start_time": frame_number / fps,
-                    "bbox": {
-                        "top_left": [speaking_face[3], speaking_face[0]],
-                        "bottom_right": [speaking_face[1], speaking_face[2]]
-                    }
-                })
+        # Per-frame crop track for a single-decode render
+        crop_track = crop_track_from_segments(speaking_frames, total_frames, fps, width, height)
 
-        cap.release()
+        # 85% progress before rendering
+        report_progress(85)
 
-        # 75% progress after frame processing
-        print_flush(json.dumps({"progress": 75}))
-
-        # Generate ffmpeg filter complex
-        filter_complex = ""
-        for i, frame in enumerate(speaking_frames):
-            # Calculate progress from 75% to 85% during filter complex generation
-            progress = 75 + int((i / len(speaking_frames)) * 10)
-            if i % 5 == 0:  # Update progress every 5 frames
-                print_flush(json.dumps({"progress": progress}))
-                
-            next_frame = speaking_frames[i+1] if i+1 < len(speaking_frames) else {"start_time": frame["start_time"] + 0.5}
-            duration = next_frame["start_time"] - frame["start_time"]
-
-            x1, y1 = frame["bbox"]["top_left"]
-            x2, y2 = frame["bbox"]["bottom_right"]
-            cx, cy = (x1 + x2) // 2, (y1 + y2) // 2
-            w, h = x2 - x1, y2 - y1
-
-            # Expand the box
-            expand_factor = 2.75
-            new_w = int(w * expand_factor)
-            new_h = int(h * expand_factor)
-            new_x1 = max(0, cx - new_w // 2)
-            new_y1 = max(0, cy - new_h // 2)
-            new_x2 = min(width, new_x1 + new_w)
-            new_y2 = min(height, new_y1 + new_h)
-
-            filter_complex += f"[0:v]trim=start={frame['start_time']}:duration={duration},setpts=PTS-STARTPTS,"
-            filter_complex += f"crop={new_x2-new_x1}:{new_y2-new_y1}:{new_x1}:{new_y1},"
-            filter_complex += f"scale={width}:{height}:force_original_aspect_ratio=increase,"
-            filter_complex += f"crop={width}:{height},setsar=1[v{i}];"
-
-        # 85% progress before ffmpeg
-        print_flush(json.dumps({"progress": 85}))
-
-        filter_complex += "".join(f"[v{i}]" for i in range(len(speaking_frames)))
-        filter_complex += f"concat=n={len(speaking_frames)}:v=1:a=0[outv]"
-
-        # Run ffmpeg command
-        print_flush("Running ffmpeg command")
-        ffmpeg_cmd = [
-            "ffmpeg", "-y",
-            "-i", input_video,
-            "-filter_complex", filter_complex,
-            "-map", "[outv]",
-            "-map", "0:a",
-            output_video
-        ]
-
-        # 90% progress during ffmpeg processing
-        print_flush(json.dumps({"progress": 90}))
-        subprocess.run(ffmpeg_cmd, check=True)
+        print_flush("Rendering dynamic crop")
+        # 90% progress during rendering
+        report_progress(90)
+        with Stage("render", media_duration=total_frames / fps) as stage:
+            render_crop_track(input_video, output_video, crop_track, width, height, fps, stage=stage)
 
         print_flush("Video processing completed successfully")
         # 100% progress when complete
-        print_flush(json.dumps({"progress": 100}))
-        return {"processedVideoUrl": output_video}
+        report_progress(100)
+        return {"processedVideoUrl": output_video, "speakerSegments": speaker_records(speaking_frames, speaker_of)}
     except Exception as e:
-        print_flush(json.dumps({"progress": "error"}))
+        report_error(str(e))
         print_flush(f"Error processing video: {str(e)}", file=sys.stderr)
         traceback.print_exc(file=sys.stderr)
+        # Don't wait on the other workers' tasks at exit
+        shutdown_pool(terminate=True)
         sys.exit(1)
 
 if __name__ == "__main__":
@@ -173,9 +214,12 @@ if __name__ == "__main__":
         output_video = os.path.abspath(sys.argv[2])
         project_id = sys.argv[3]
 
-        result = process_video(input_video, output_video)
-        print_flush(json.dumps(result))
+        result = process_video(input_video, output_video, project_id)
+        report_result(result)
     except Exception as e:
+        report_error(str(e))
         print_flush(f"Unhandled exception: {str(e)}", file=sys.stderr)
         traceback.print_exc(file=sys.stderr)
+        # Don't wait on the other workers' tasks at exit
+        shutdown_pool(terminate=True)
         sys.exit(1)
@@ -1,12 +1,21 @@
 import cv2
 import numpy as np
-import face_recognition
 import os
 import sys
-import json
 import traceback
-import subprocess
-from multiprocessing import Pool, cpu_count
+from media_probe import get_video_info
+from face_detectors import detect_faces_with_landmarks_batch, mouth_patch, mouth_region_bounds, warm_up_detectors
+from frame_sampler import frame_shape, sample_step
+from frame_pipeline import POOL_PROCESSES, frame_of, gated_imap, get_pool, make_frame_ring, sample_into_ring, shutdown_pool
+from frame_gate import FrameChangeGate
+from reporting import Stage, report_error, report_result
+from crop_render import render_crop_track
+from virtual_camera import virtual_camera_track
+from detection_timeline import DetectionTimeline, merge_similar_segments
+from face_tracking import FaceTracker, select_active_speaker
+from adaptive_sampling import COARSE_SAMPLES_PER_SECOND, mouth_probe, refine_switches
+from shot_index import get_shot_index, shot_of, shot_sample_frames
+from speaker_identity import SpeakerIdentities, identify_tracks, speaker_records
 
 def print_flush(*args, **kwargs):
     print(*args, **kwargs)
@@ -14,182 +23,183 @@ def print_flush(*args, **kwargs):
 
 print_flush("Python script started")
 
-def bbox_iou(box1, box2):
-    """Calculate IOU between two bounding boxes"""
-    x1_1, y1_1 = box1["top_left"]
-    x2_1, y2_1 = box1["bottom_right"]
-    x1_2, y1_2 = box2["top_left"]
-    x2_2, y2_2 = box2["bottom_right"]
-    
-    # Calculate intersection
-    x1_i = max(x1_1, x1_2)
-    y1_i = max(y1_1, y1_2)
-    x2_i = min(x2_1, x2_2)
-    y2_i = min(y2_1, y2_2)
-    
-    if x2_i < x1_i or y2_i < y1_i:
-        return 0.0
-    
-    intersection = (x2_i - x1_i) * (y2_i - y1_i)
-    
-    # Calculate union
-    area1 = (x2_1 - x1_1) * (y2_1 - y1_1)
-    area2 = (x2_2 - x1_2) * (y2_2 - y1_2)
-    union = area1 + area2 - intersection
-    
-    return intersection / union
-
-def detect_faces_fast(frame):
-    small_frame = cv2.resize(frame, (0, 0), fx=0.25, fy=0.25)
-    gray_frame = cv2.cvtColor(small_frame, cv2.COLOR_RGB2GRAY)
-    
-    face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-    faces = face_cascade.detectMultiScale(gray_frame, 1.1, 4)
-    
-    face_locations = []
-    for (x, y, w, h) in faces:
-        face_locations.append(
-            (int(y*4), int((x+w)*4), int((y+h)*4), int(x*4))
-        )
-    
-    return face_locations
+# Coarse samples between looks at a shot while it shows at most one face; such shots
+# can't switch speaker, so they aren't sampled at the full coarse rate
+SHOT_RECHECK_SAMPLES = 5
 
 def process_frame(args):
+    """Returns (time, faces, mouth patches); faces are (face_location, landmarks) pairs"""
     frame_number, frame, fps = args
-    face_locations = detect_faces_fast(frame)
-    
-    speaking_frame = None
-    if face_locations:
-        speaking_frame = {
-            "start_time": frame_number / fps,
-            "bbox": {
-                "top_left": [face_locations[0][3], face_locations[0][0]],
-                "bottom_right": [face_locations[0][1], face_locations[0][2]]
-            }
-        }
-    
-    return speaking_frame
-
-def merge_similar_segments(speaking_frames, iou_threshold=0.7, min_duration=1.0):
-    """Merge similar segments and filter out short duration switches"""
-    if not speaking_frames:
-        return []
-    
-    merged = []
-    current_segment = speaking_frames[0].copy()
-    
-    for i in range(1, len(speaking_frames)):
-        current_frame = speaking_frames[i]
-        
-        # Calculate IOU between current frame and current segment
-        iou = bbox_iou(current_frame["bbox"], current_segment["bbox"])
-        
-        # If boxes are similar enough, extend current segment
-        if iou >= iou_threshold:
-            continue
-        else:
-            # Check if the previous segment was long enough
-            duration = current_frame["start_time"] - current_segment["start_time"]
-            if duration >= min_duration:
-                merged.append(current_segment)
-                current_segment = current_frame.copy()
-            else:
-                # If duration is too short, keep the previous segment
-                continue
-    
-    # Add the last segment if it's long enough
-    if speaking_frames[-1]["start_time"] - current_segment["start_time"] >= min_duration:
-        merged.append(current_segment)
-    
-    return merged
-
-def get_video_info(video_path):
-    cmd = ['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-count_packets',
-           '-show_entries', 'stream=width,height,nb_read_packets,r_frame_rate',
-           '-of', 'json', video_path]
-    result = subprocess.run(cmd, capture_output=True, text=True)
-    info = json.loads(result.stdout)['streams'][0]
-    width = int(info['width'])
-    height = int(info['height'])
-    total_frames = int(info['nb_read_packets'])
-    fps = eval(info['r_frame_rate'])
-    return width, height, total_frames, fps
-
-def process_video(input_video, output_video):
+    faces = detect_faces_with_landmarks_batch([frame])[0]
+
+    patches = [mouth_patch(frame, face_location, landmarks) for face_location, landmarks in faces]
+    return frame_number / fps, faces, patches
+
+def process_frame_slot(args):
+    """Pool task for a frame held in a SharedFrameRing; returns (slot, process_frame result)"""
+    frame_ref, slot, frame_number, fps = args
+    return slot, process_frame((frame_number, frame_of(frame_ref), fps))
+
+def process_video(input_video, output_video, project_id=None):
     try:
         print_flush(f"Processing video: {input_video}")
         print_flush(f"Output video: {output_video}")
 
-        width, height, total_frames, fps = get_video_info(input_video)
+        with Stage("probe"):
+            width, height, total_frames, fps = get_video_info(input_video)
         print_flush(f"Video properties: FPS={fps}, Width={width}, Height={height}, Total Frames={total_frames}")
+        media_duration = total_frames / fps
+
+        # Shot boundaries from one thumbnail pass (cached per input): sampling starts
+        # fresh at every shot and the virtual camera cuts with the source
+        with Stage("shots", media_duration=media_duration) as stage:
+            shots = get_shot_index(input_video)
+            stage.set_metric("shots", len(shots["cuts"]) + 1)
+
+        # Coarse pass in one linear decode of the grid of every step frames within each shot.
+        # A shot is looked at near its start and then every SHOT_RECHECK_SAMPLES steps; the
+        # grid frames in between are only tracked once a look has found more than one face,
+        # as only such shots can switch speaker. Skipped frames cost their decode but no
+        # detection or tracking. Switch points are refined to the frame afterwards
+        step = sample_step(fps, COARSE_SAMPLES_PER_SECOND)
+        grid = [n for n in shot_sample_frames(shots, step) if n < total_frames]
+        sample_shots = dict(zip(grid, shot_of(shots, grid).tolist()))
+        # Same first frame per shot and a multiple of step, so these are grid frames too
+        rechecks = np.array([n for n in shot_sample_frames(shots, step * SHOT_RECHECK_SAMPLES) if n < total_frames])
+        # The look each grid frame waits for: the latest one at or before it, always in its shot
+        look_of = dict(zip(grid, rechecks[np.searchsorted(rechecks, grid, side='right') - 1].tolist())) if grid else {}
+
+        # Mouth activity averaged over about two seconds of coarse samples; a track
+        # survives one missed sample (max_gap follows each shot's sampling interval)
+        tracker = FaceTracker(activity_window=2 * COARSE_SAMPLES_PER_SECOND)
+        gate = FrameChangeGate()
+        times, boxes, activity, track_ids = [], [], [], []
+        with Stage("detect", media_duration=media_duration) as stage:
+            # Warm pool: survives across videos in this process, cascade already loaded in each worker
+            pool = get_pool(warmups=(warm_up_detectors,))
+            # Frames are decoded straight into shared-memory slots; workers only receive slot indices.
+            # The ring size bounds how many frames are in flight.
+            shape = frame_shape(input_video)
+            ring = make_frame_ring(shape, POOL_PROCESSES * 2 + 2)
+            try:
+                tasks = (
+                    (ring.ref(slot), slot, frame_number, fps)
+                    for slot, frame_number in sample_into_ring(ring, input_video, step,
+                                                               color_conversion=cv2.COLOR_BGR2RGB,
+                                                               frame_numbers=grid)
+                )
+                # Shots where a look found more than one face, looks whose faces are in, and
+                # grid frames passed over in the other shots
+                crowded, looked, skipped = set(), set(), set()
+                # Static frames skip the detector: only frames that changed outside the
+                # mouths since the last detection, or start a new shot, are sent to the pool.
+                # The gate runs here in the consumer, so its mouth mask is always the one
+                # of its own reference frame, and it sees every look consumed so far.
+                gate_shot = [None]
+
+                def needs_detection(task):
+                    _, slot, frame_number, _ = task
+                    shot = sample_shots[frame_number]
+                    if look_of[frame_number] != frame_number and shot not in crowded:
+                        if look_of[frame_number] not in looked:
+                            # Wait for the shot's latest look before passing over this frame
+                            return None
+                        skipped.add(frame_number)
+                        return False
+                    detect = gate.needs_detection(ring.frames[slot], key=frame_number, force=shot != gate_shot[0])
+                    if detect is not None:
+                        gate_shot[0] = shot
+                    return detect
+
+                last_faces = []
+                current_shot = None
+                results = gated_imap(pool, process_frame_slot, tasks, needs_detection, ring.slots - 1)
+                for i, (task, result) in enumerate(results):
+                    _, slot, frame_number, _ = task
+                    if frame_number in skipped:
+                        ring.release(slot)
+                        continue
+                    shot = sample_shots[frame_number]
+                    if shot != current_shot:
+                        # Faces don't carry over a cut
+                        current_shot = shot
+                        tracker.reset()
+                    if result is not None:
+                        _, (time, last_faces, patches) = result
+                        gate.set_mouth_regions(frame_number, [mouth_region_bounds(*face) for face in last_faces])
+                    else:
+                        # Previous boxes still hold; only the mouth patches are new
+                        time = frame_number / fps
+                        frame = ring.frames[slot]
+                        patches = [mouth_patch(frame, face_location, landmarks) for face_location, landmarks in last_faces]
+                    ring.release(slot)
+                    if look_of[frame_number] == frame_number:
+                        looked.add(frame_number)
+                        if len(last_faces) > 1:
+                            crowded.add(shot)
+
+                    # Results arrive in frame order, so tracking runs here in the consumer
+                    interval = step if shot in crowded else step * SHOT_RECHECK_SAMPLES
+                    tracker.max_gap = 2.5 * interval / fps
+                    frame_boxes = [(left, top, right, bottom) for (top, right, bottom, left), _ in last_faces]
+                    frame_track_ids, frame_activity = tracker.update(time, frame_boxes, patches)
+                    times.extend([time] * len(frame_boxes))
+                    boxes.extend(frame_boxes)
+                    activity.extend(frame_activity)
+                    track_ids.extend(frame_track_ids)
+                    stage.add_frames()
+                    stage.progress(i / len(grid))
+            finally:
+                ring.close()
+            stage.set_metric("dense_shots", len(crowded))
+            stage.set_metric("skipped_frames", len(skipped))
+            stage.set_metric("tracks", tracker.next_id)
+            stage.set_metric("detector_call_rate", round(gate.call_rate, 3))
+        faces = DetectionTimeline(times, boxes, activity, track_ids)
+
+        # Who each track is: a few embeddings per track, matched against the project's known
+        # speakers; without a project there is nothing to match against or persist
+        speaker_of = {}
+        if project_id:
+            with Stage("identity") as stage:
+                identities = SpeakerIdentities(project_id)
+                speaker_of, embedded = identify_tracks(input_video, faces, fps, identities)
+                identities.save()
+                stage.set_metric("embedded_faces", embedded)
+                stage.set_metric("speakers", len(set(speaker_of.values())))
+
+        # Zoom on the tracked face with the most mouth activity at each sample
+        speaking_frames = select_active_speaker(faces)
+
+        # Bisect between coarse samples where the speaker changes, down to one frame
+        with Stage("refine") as stage:
+            speaking_frames, refined_frames = refine_switches(speaking_frames, fps, mouth_probe(input_video, fps),
+                                                              cuts=shots["cuts"])
+            stage.set_metric("refined_frames", refined_frames)
 
-        cap = cv2.VideoCapture(input_video)
-        frames_to_process = range(0, total_frames, int(fps/4))
-        frames = []
-        
-        for frame_number in frames_to_process:
-            cap.set(cv2.CAP_PROP_POS_FRAMES, frame_number)
-            ret, frame = cap.read()
-            if not ret:
-                break
-            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            frames.append((frame_number, frame, fps))
-
-        with Pool(processes=cpu_count()) as pool:
-            speaking_frames = pool.map(process_frame, frames)
-        
-        speaking_frames = [f for f in speaking_frames if f is not None]
-        
         # Merge similar segments and filter out short switches
-        speaking_frames = merge_similar_segments(speaking_frames, 
-                                              iou_threshold=0.6,  # 60% overlap threshold
-                                              min_duration=1.0)   # 1 second minimum duration
-
-        cap.release()
-
-        filter_complex = ""
-        for i, frame in enumerate(speaking_frames):
-            next_frame = speaking_frames[i+1] if i+1 < len(speaking_frames) else {"start_time": frame["start_time"] + 0.25}
-            duration = next_frame["start_time"] - frame["start_time"]
-
-            x1, y1 = frame["bbox"]["top_left"]
-            x2, y2 = frame["bbox"]["bottom_right"]
-            cx, cy = (x1 + x2) // 2, (y1 + y2) // 2
-            w, h = x2 - x1, y2 - y1
-
-            expand_factor = 2.75
-            new_w = int(w * expand_factor)
-            new_h = int(h * expand_factor)
-            new_x1 = max(0, cx - new_w // 2)
-            new_y1 = max(0, cy - new_h // 2)
-            new_x2 = min(width, new_x1 + new_w)
-            new_y2 = min(height, new_y1 + new_h)
-
-            filter_complex += f"[0:v]trim=start={frame['start_time']}:duration={duration},setpts=PTS-STARTPTS,"
-            filter_complex += f"crop={new_x2-new_x1}:{new_y2-new_y1}:{new_x1}:{new_y1},"
-            filter_complex += f"scale={width}:{height}:force_original_aspect_ratio=increase,"
-            filter_complex += f"crop={width}:{height},setsar=1[v{i}];"
-
-        filter_complex += "".join(f"[v{i}]" for i in range(len(speaking_frames)))
-        filter_complex += f"concat=n={len(speaking_frames)}:v=1:a=0[outv]"
-
-        ffmpeg_cmd = [
-            "ffmpeg", "-y",
-            "-i", input_video,
-            "-filter_complex", filter_complex,
-            "-map", "[outv]",
-            "-map", "0:a",
-            output_video
-        ]
-
-        print_flush("Running ffmpeg command")
-        subprocess.run(ffmpeg_cmd, check=True)
+        with Stage("merge") as stage:
+            speaking_frames = merge_similar_segments(speaking_frames,
+                                                  iou_threshold=0.6,  # 60% overlap threshold
+                                                  min_duration=1.0)   # 1 second minimum duration
+            stage.set_metric("segments", len(speaking_frames))
+
+        # One decode, one encoder: the crop follows a smoothed per-frame virtual camera
+        # path instead of jumping to each segment's box
+        crop_track = virtual_camera_track(speaking_frames, total_frames, fps, width, height, cuts=shots["cuts"])
+
+        print_flush("Rendering dynamic crop")
+        with Stage("render", media_duration=media_duration) as stage:
+            render_crop_track(input_video, output_video, crop_track, width, height, fps, stage=stage)
 
         print_flush("Video processing completed successfully")
-        return {"processedVideoUrl": output_video}
+        return {"processedVideoUrl": output_video, "speakerSegments": speaker_records(speaking_frames, speaker_of)}
     except Exception as e:
+        report_error(str(e))
         print_flush(f"Error processing video: {str(e)}", file=sys.stderr)
         traceback.print_exc(file=sys.stderr)
+        # Don't wait on the other workers' tasks at exit
+        shutdown_pool(terminate=True)
         sys.exit(1)
 
 if __name__ == "__main__":
@@ -203,9 +213,12 @@ if __name__ == "__main__":
         output_video = os.path.abspath(sys.argv[2])
         project_id = sys.argv[3]
 
-        result = process_video(input_video, output_video)
-        print_flush(json.dumps(result))
+        result = process_video(input_video, output_video, project_id)
+        report_result(result)
     except Exception as e:
+        report_error(str(e))
         print_flush(f"Unhandled exception: {str(e)}", file=sys.stderr)
         traceback.print_exc(file=sys.stderr)
+        # Don't wait on the other workers' tasks at exit
+        shutdown_pool(terminate=True)
         sys.exit(1)
@@ -0,0 +1,153 @@
+import re
+import numpy as np
+import face_recognition
+from scipy.cluster.hierarchy import fcluster, linkage
+from frame_sampler import read_frames_at
+from stage_cache import load_cached_json, save_cached_json
+
+# Face distance (face_recognition's 128-d embeddings) under which two faces are the same
+# person; face_recognition's own default of 0.6 merges look-alikes too readily
+MATCH_TOLERANCE = 0.5
+# Embeddings kept per known speaker; older ones are dropped first
+MAX_EMBEDDINGS_PER_SPEAKER = 32
+# Camera -> speaker maps kept per project, one per set of camera inputs; oldest dropped first
+MAX_CAMERA_MAPS = 16
+
+
+def face_embeddings(frame, face_locations):
+    """(N, 128) embeddings of known (top, right, bottom, left) faces in an RGB frame; no detection runs"""
+    if not face_locations:
+        return np.zeros((0, 128))
+    return np.array(face_recognition.face_encodings(frame, known_face_locations=list(face_locations), model="small"))
+
+def cluster_embeddings(embeddings, tolerance=MATCH_TOLERANCE):
+    """Cluster label per embedding (average linkage, clusters no wider than tolerance on average)"""
+    embeddings = np.asarray(embeddings).reshape(-1, 128)
+    if len(embeddings) < 2:
+        return np.zeros(len(embeddings), dtype=np.int64)
+    return fcluster(linkage(embeddings, method='average'), t=tolerance, criterion='distance') - 1
+
+class SpeakerIdentities:
+    """
+    Speakers seen in a project, as a few face embeddings each, persisted in the
+    "identities" cache under the project ID together with the camera -> speaker maps of the
+    most recent camera inputs (see remember_cameras).
+
+    identify() takes groups of embeddings that belong to one face each (a track, a camera)
+    and returns a speaker ID per group: groups are clustered among themselves, and each
+    cluster joins the closest known speaker within tolerance or becomes a new one. Only
+    a handful of embeddings per group are needed; everything else is looked up by group.
+    """
+
+    def __init__(self, project_id=None, tolerance=MATCH_TOLERANCE):
+        self.project_id = project_id
+        self.tolerance = tolerance
+        self.speakers = {}
+        self.cameras = {}
+        data = load_cached_json("identities", self.cache_name) if self.cache_name else None
+        if data is not None:
+            self.speakers = {int(sid): np.array(e) for sid, e in data.get("speakers", {}).items()}
+            # Maps are keyed by camera inputs; anything else is from an older layout
+            self.cameras = {key: cameras for key, cameras in data.get("cameras", {}).items()
+                            if isinstance(cameras, dict)}
+
+    @property
+    def cache_name(self):
+        if not self.project_id:
+            return None
+        return re.sub(r'[^A-Za-z0-9_.-]', '_', str(self.project_id))
+
+    def save(self):
+        if self.cache_name is None:
+            return
+        save_cached_json("identities", self.cache_name, {
+            "speakers": {str(sid): embeddings.tolist() for sid, embeddings in self.speakers.items()},
+            "cameras": self.cameras
+        })
+
+    def _assign(self, embeddings):
+        """Speaker ID for embeddings of one person, learning them into the project"""
+        centre = embeddings.mean(axis=0)
+        best, best_distance = None, self.tolerance
+        for speaker_id, known in self.speakers.items():
+            distance = np.linalg.norm(known.mean(axis=0) - centre)
+            if distance <= best_distance:
+                best, best_distance = speaker_id, distance
+        if best is None:
+            best = max(self.speakers, default=-1) + 1
+            self.speakers[best] = embeddings[-MAX_EMBEDDINGS_PER_SPEAKER:]
+        else:
+            self.speakers[best] = np.vstack([self.speakers[best], embeddings])[-MAX_EMBEDDINGS_PER_SPEAKER:]
+        return best
+
+    def matches(self, speaker_id, embeddings):
+        """Whether embeddings of one person belong to a known speaker, within tolerance"""
+        known = self.speakers.get(speaker_id)
+        if known is None or not len(embeddings):
+            return False
+        return np.linalg.norm(known.mean(axis=0) - np.mean(embeddings, axis=0)) <= self.tolerance
+
+    def last_cameras(self):
+        """Most recently remembered camera -> speaker map, or None"""
+        return next(reversed(self.cameras.values()), None)
+
+    def remember_cameras(self, input_key, camera_speakers):
+        """Record the camera -> speaker map of one set of camera inputs as the most recent"""
+        self.cameras.pop(input_key, None)
+        self.cameras[input_key] = camera_speakers
+        while len(self.cameras) > MAX_CAMERA_MAPS:
+            self.cameras.pop(next(iter(self.cameras)))
+
+    def identify(self, groups):
+        """groups: {key: (n, 128) embeddings}; returns {key: speaker_id} for non-empty groups"""
+        keys = [key for key, embeddings in groups.items() if len(embeddings)]
+        if not keys:
+            return {}
+        means = np.array([np.mean(groups[key], axis=0) for key in keys])
+        labels = cluster_embeddings(means, self.tolerance)
+        speaker_of = {}
+        for label in np.unique(labels):
+            members = [key for key, member_label in zip(keys, labels) if member_label == label]
+            speaker_id = self._assign(np.vstack([groups[key] for key in members]))
+            speaker_of.update((key, speaker_id) for key in members)
+        return speaker_of
+
+def identify_tracks(video_path, faces, fps, identities, samples_per_track=3):
+    """
+    Speaker ID per track of a tracked DetectionTimeline ({track_id: speaker_id}).
+    Only samples_per_track detections per track, spread over its lifetime, are embedded;
+    frames are decoded in one pass and each frame's faces are embedded in one call.
+    Returns (mapping, number of faces embedded).
+    """
+    wanted = {}
+    for track_id in np.unique(faces.track_ids[faces.track_ids >= 0]).tolist():
+        rows = np.flatnonzero(faces.track_ids == track_id)
+        picks = rows[np.unique(np.linspace(0, len(rows) - 1, min(samples_per_track, len(rows))).astype(int))]
+        for row in picks.tolist():
+            frame_number = int(round(faces.times[row] * fps))
+            wanted.setdefault(frame_number, []).append(row)
+
+    frames = read_frames_at(video_path, sorted(wanted))
+    groups = {}
+    embedded = 0
+    for frame_number, rows in wanted.items():
+        frame = frames.get(frame_number)
+        if frame is None:
+            continue
+        locations = [(y1, x2, y2, x1) for x1, y1, x2, y2 in faces.boxes[rows].tolist()]
+        # Frames come from OpenCV (BGR); face_recognition expects RGB
+        embeddings = face_embeddings(np.ascontiguousarray(frame[:, :, ::-1]), locations)
+        embedded += len(embeddings)
+        for row, embedding in zip(rows, embeddings):
+            groups.setdefault(int(faces.track_ids[row]), []).append(embedding)
+
+    speaker_of = identities.identify({track_id: np.array(e) for track_id, e in groups.items()})
+    return speaker_of, embedded
+
+def speaker_records(timeline, speaker_of):
+    """Speaking-frame records with a "speaker_id" for rows whose track has an identity"""
+    records = timeline.to_records()
+    for record in records:
+        if record.get("track_id") in speaker_of:
+            record["speaker_id"] = speaker_of[record["track_id"]]
+    return records
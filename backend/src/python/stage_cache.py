@@ -0,0 +1,125 @@
+import os
+import json
+import time
+import hashlib
+
+MANIFEST_NAME = "manifest.json"
+FINGERPRINT_BLOCK = 1024 * 1024
+# Caches kept across jobs (media probes, shot indexes, project speakers), one
+# subdirectory per kind under this root
+CACHE_ROOT = os.environ.get(
+    "QARIO_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "qario")
+)
+
+
+def file_fingerprint(path):
+    """
+    Cheap content fingerprint of a media file: size plus hashes of its first and last MiB.
+    Hashing whole multi-GB camera files would cost more than some of the stages it guards.
+    """
+    size = os.path.getsize(path)
+    digest = hashlib.sha256(str(size).encode())
+    with open(path, 'rb') as f:
+        digest.update(f.read(FINGERPRINT_BLOCK))
+        if size > FINGERPRINT_BLOCK:
+            f.seek(max(FINGERPRINT_BLOCK, size - FINGERPRINT_BLOCK))
+            digest.update(f.read(FINGERPRINT_BLOCK))
+    return digest.hexdigest()
+
+def save_json(path, data):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+    return path
+
+def load_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+def cached_json_path(kind, name):
+    return os.path.join(CACHE_ROOT, kind, name + ".json")
+
+def load_cached_json(kind, name):
+    """A JSON entry of the persistent cache, or None if it is missing or unreadable"""
+    try:
+        return load_json(cached_json_path(kind, name))
+    except (OSError, ValueError):
+        return None
+
+def save_cached_json(kind, name, data):
+    path = cached_json_path(kind, name)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        save_json(path, data)
+    except OSError:
+        # The cache is an optimization; an unwritable cache dir must not fail the job
+        pass
+
+class StageCache:
+    """
+    Content-addressed store for pipeline stage artifacts.
+
+    Every stage run lives in <root>/<stage>/<key>/, where key hashes the stage inputs
+    (input fingerprints, parameters and the keys of upstream stages). A manifest is
+    written last, so a stage that crashed half-way is never mistaken for a finished one.
+    """
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+
+    def key(self, stage, **inputs):
+        payload = json.dumps({"stage": stage, "inputs": inputs}, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()[:32]
+
+    def stage_dir(self, stage, key):
+        path = os.path.join(self.root, stage, key)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def artifact_path(self, stage, key, name):
+        return os.path.join(self.stage_dir(stage, key), name)
+
+    def load(self, stage, key):
+        """Return the manifest of a completed stage run, or None if it is missing or stale"""
+        manifest_path = os.path.join(self.root, stage, key, MANIFEST_NAME)
+        if not os.path.exists(manifest_path):
+            return None
+        try:
+            manifest = load_json(manifest_path)
+        except (OSError, ValueError):
+            return None
+
+        for artifact in manifest["artifacts"].values():
+            try:
+                stat = os.stat(artifact["path"])
+            except OSError:
+                return None
+            if stat.st_size != artifact["size"] or stat.st_mtime_ns != artifact["mtime_ns"]:
+                return None
+        return manifest
+
+    def save(self, stage, key, artifacts, metadata=None):
+        """
+        Record a completed stage run.
+        artifacts: dict of name -> path; paths outside the stage dir (e.g. the final output) are allowed
+        """
+        recorded = {}
+        for name, path in artifacts.items():
+            stat = os.stat(path)
+            recorded[name] = {
+                "path": os.path.abspath(path),
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns
+            }
+        manifest = {
+            "stage": stage,
+            "key": key,
+            "created": time.time(),
+            "artifacts": recorded,
+            "metadata": metadata or {}
+        }
+        save_json(os.path.join(self.stage_dir(stage, key), MANIFEST_NAME), manifest)
+        return manifest
@@ -1,79 +1,97 @@
 import sys
-import cv2
 import numpy as np
+from scipy.io import wavfile
 from scipy.signal import correlate, butter, filtfilt, medfilt
-from moviepy.editor import VideoFileClip, AudioFileClip, concatenate_videoclips
-from moviepy.audio.AudioClip import AudioArrayClip
+from moviepy.editor import VideoFileClip, AudioFileClip, concatenate_audioclips, concatenate_videoclips
 import os
-from speaker_detection_zoom import detect_faces_fast
+import json
+import wave
+import shutil
+import subprocess
+import traceback
+from dataclasses import dataclass, field, asdict
+from face_detectors import detect_faces_with_landmarks_batch, detector_backend, mouth_region_bounds, warm_up_detectors
+from lip_activity import lip_backend, make_lip_activity
+from media_probe import probe_media
+from stage_cache import StageCache, file_fingerprint, save_json, load_json
+from reporting import Stage, report_error, report_result
+from frame_pipeline import POOL_PROCESSES, frame_of, gated_imap, get_pool, make_frame_ring, shutdown_pool
+from frame_gate import FrameChangeGate
+from speaker_identity import SpeakerIdentities, face_embeddings
+
+# Camera order of every per-camera tuple, array column and result dict in this module
+CAMERA_NAMES = ('left', 'main', 'right')
 
 
 # Convert audio to numpy arrays correctly
-def audio_to_array(audio_clip):
+def audio_to_array(audio_clip, duration=None):
     if audio_clip is None:
         return np.array([])
+    if duration is not None and duration < audio_clip.duration:
+        # Only decode the leading excerpt (windowed mode)
+        audio_clip = audio_clip.subclip(0, duration)
     chunks = list(audio_clip.iter_chunks(chunksize=1024))
     if not chunks:
         return np.array([])
     return np.concatenate(chunks)
 
-def sync_audio_with_video(video_path, audio_path):
+def sync_audio_with_video(video, audio, delay=None, analysis_duration=None):
     """
-    Synchronize audio with video using audio waveform analysis
+    Synchronize audio with video using audio waveform analysis.
+    video, audio: opened clips; an audio clip may be shared by several cameras.
+    A previously computed delay skips the analysis. Returns (synced_video, delay).
+    analysis_duration: only correlate the first N seconds (the offset is constant over the episode)
     """
     try:
-        video = VideoFileClip(video_path)
-        audio = AudioFileClip(audio_path)
-        
-        # Extract audio from video and convert to arrays
-        video_audio = video.audio
-        
+        if delay is None:
+            # Extract audio from video and convert to arrays
+            video_audio = video.audio
 
-        video_audio_array = audio_to_array(video_audio)
-        audio_array = audio_to_array(audio)
-        
-        # Find sync point using cross-correlation
-        delay = find_sync_offset(video_audio_array, audio_array)
+            video_audio_array = audio_to_array(video_audio, analysis_duration)
+            audio_array = audio_to_array(audio, analysis_duration)
+            
+            # Find sync point using cross-correlation
+            delay = find_sync_offset(video_audio_array, audio_array)
         
         # Apply the delay to the audio
         synced_audio = audio.subclip(max(0, -delay))
         if delay > 0:
-            synced_audio = AudioFileClip(audio_path).set_start(delay)
+            synced_audio = audio.set_start(delay)
         
         synced_video = video.set_audio(synced_audio)
         
-        return synced_video
+        return synced_video, delay
         
     except Exception as e:
         print(f"Error in sync_audio_with_video: {str(e)}")
         # Fallback: return video with original audio
-        return video.set_audio(audio)
+        return video.set_audio(audio), 0.0
 
-def sync_cameras(left_video, main_video, right_video):
+def sync_cameras(left_video, main_video, right_video, delays=None, analysis_duration=None):
     """
-    Synchronize cameras while preserving original video-audio sync
+    Synchronize cameras while preserving original video-audio sync.
+    Previously computed delays ({'left', 'right'} relative to main) skip the analysis.
+    Returns (left_synced, main_synced, right_synced, delays).
     """
-    # Get audio from each video
-    left_audio = left_video.audio
-    main_audio = main_video.audio
-    right_audio = right_video.audio
-    
-    # Convert to arrays
-    def audio_to_array(audio):
-        if audio is None:
-            return np.array([])
-        chunks = list(audio.iter_chunks(chunksize=1024))
-        if not chunks:
-            return np.array([])
-        return np.concatenate(chunks)
+    if delays is None:
+        # Get audio from each video
+        left_audio = left_video.audio
+        main_audio = main_video.audio
+        right_audio = right_video.audio
 
-    left_array = audio_to_array(left_audio)
-    main_array = audio_to_array(main_audio)
-    right_array = audio_to_array(right_audio)
-    
-    # Find sync points
-    left_delay = find_sync_offset(left_array, main_array)
-    right_delay = find_sync_offset(right_array, main_array)
+        left_array = audio_to_array(left_audio, analysis_duration)
+        main_array = audio_to_array(main_audio, analysis_duration)
+        right_array = audio_to_array(right_audio, analysis_duration)
+        
+        # Find sync points
+        delays = {
+            'left': find_sync_offset(left_array, main_array),
+            'right': find_sync_offset(right_array, main_array)
+        }
+        del left_array, main_array, right_array
+
+    left_delay = delays['left']
+    right_delay = delays['right']
     
     # Determine the global start time
     global_start = max(0, -left_delay, -right_delay)
@@ -108,34 +126,53 @@ def sync_cameras(left_video, main_video, right_video):
     print(f"Synced durations - Left: {left_synced.duration}, Main: {main_synced.duration}, Right: {right_synced.duration}")
     print(f"Synced audio durations - Left: {left_synced.audio.duration}, Main: {main_synced.audio.duration}, Right: {right_synced.audio.duration}")
     
-    return left_synced, main_synced, right_synced
+    return left_synced, main_synced, right_synced, delays
 
-def detect_mouth_movement(frame):
-    face_locations = detect_faces_fast(frame)
-    
-    if not face_locations:
+def open_synced_cameras(left_camera, main_camera, right_camera, left_audio, right_audio, sync=None,
+                        analysis_duration=None):
+    """
+    Open the three cameras with their external audio attached and aligned to each other.
+    sync: offsets from a previous run ({'audio_delays', 'camera_delays'}); computed when None
+    analysis_duration: seconds of audio decoded per input for the offset search (None = all)
+    Returns (left_synced, main_synced, right_synced, sync).
+    """
+    audio_delays = sync['audio_delays'] if sync else {}
+
+    # Open every input exactly once; the left mic is shared by the left and main cameras
+    left_audio_clip = AudioFileClip(left_audio)
+    right_audio_clip = AudioFileClip(right_audio)
+
+    print("Syncing left camera...")
+    left_synced, left_delay = sync_audio_with_video(VideoFileClip(left_camera), left_audio_clip,
+                                                    audio_delays.get('left'), analysis_duration)
+    print("Syncing main camera...")
+    main_synced, main_delay = sync_audio_with_video(VideoFileClip(main_camera), left_audio_clip,
+                                                    audio_delays.get('main'), analysis_duration)
+    print("Syncing right camera...")
+    right_synced, right_delay = sync_audio_with_video(VideoFileClip(right_camera), right_audio_clip,
+                                                      audio_delays.get('right'), analysis_duration)
+
+    print("Syncing all cameras together...")
+    left_synced, main_synced, right_synced, camera_delays = sync_cameras(
+        left_synced, main_synced, right_synced,
+        sync['camera_delays'] if sync else None,
+        analysis_duration
+    )
+
+    sync = {
+        'audio_delays': dict(zip(CAMERA_NAMES, (left_delay, main_delay, right_delay))),
+        'camera_delays': camera_delays
+    }
+    return left_synced, main_synced, right_synced, sync
+
+def largest_face_score(measured):
+    """
+    Movement score of the largest face in a lip-activity measurement (assuming the speaker
+    is likely the largest face in the frame); 0 without faces
+    """
+    if not measured:
         return 0
-    
-    # Get the largest face (assuming the speaker is likely the largest face in the frame)
-    largest_face = max(face_locations, key=lambda face: (face[2] - face[0]) * (face[1] - face[3]))
-    
-    # Extract mouth region (approximate)
-    top, right, bottom, left = largest_face
-    mouth_top = top + int((bottom - top) * 0.65)
-    mouth_bottom = bottom
-    mouth_left = left + int((right - left) * 0.25)
-    mouth_right = right - int((right - left) * 0.25)
-    
-    mouth_region = frame[mouth_top:mouth_bottom, mouth_left:mouth_right]
-    
-    # Convert to grayscale
-    gray_mouth = cv2.cvtColor(mouth_region, cv2.COLOR_RGB2GRAY)
-    
-    # Calculate the variance of the mouth region
-    # Higher variance indicates more movement
-    mouth_variance = np.var(gray_mouth)
-    
-    return mouth_variance
+    return max(measured, key=lambda face: (face[0][2] - face[0][0]) * (face[0][1] - face[0][3]))[2]
 
 def enhance_mixed_audio(audio_array, sample_rate, 
                        noise_reduction=0.1, 
@@ -165,14 +202,43 @@ def enhance_mixed_audio(audio_array, sample_rate,
     
     return filtered
 
-def smart_audio_merge(audio1, audio2, sample_rate=44100,
+def write_audio_file(output_path, audio_array, sample_rate=44100):
+    """
+    Write a normalized [-1, 1] audio array to a 16-bit PCM WAV file
+    """
+    pcm = np.clip(audio_array, -1.0, 1.0)
+    pcm = (pcm * 32767).astype(np.int16)
+    wavfile.write(output_path, sample_rate, pcm)
+    return output_path
+
+def mux_audio(video_path, audio_path, output_path):
+    """
+    Combine the video stream of one file with the audio of another, without re-encoding video
+    """
+    ffmpeg_cmd = [
+        "ffmpeg", "-y",
+        "-i", video_path,
+        "-i", audio_path,
+        "-map", "0:v:0",
+        "-map", "1:a:0",
+        "-c:v", "copy",
+        "-c:a", "aac",
+        "-ac", "2",
+        "-shortest",
+        output_path
+    ]
+    subprocess.run(ffmpeg_cmd, check=True)
+    return output_path
+
+def smart_audio_merge(audio1, audio2, output_path, sample_rate=44100,
                      noise_reduction=0.05,
                      low_cut=80,
                      high_cut=8000,
                      compression_threshold=0.7,
                      compression_ratio=0.8):
     """
-    Intelligently merge two audio streams using advanced processing techniques
+    Intelligently merge two audio streams using advanced processing techniques.
+    The merged mix is rendered once to a WAV file at output_path; returns its duration in seconds.
     """
     def audio_to_array(audio_clip):
         if audio_clip is None:
@@ -252,10 +318,179 @@ def smart_audio_merge(audio1, audio2, sample_rate=44100,
                                compression_threshold=compression_threshold,
                                compression_ratio=compression_ratio)
 
-    # Convert to stereo
-    merged_stereo = np.column_stack((merged, merged))
+    # Render the mix once; the final mux upmixes it to stereo
+    write_audio_file(output_path, merged, sample_rate)
+
+    return len(merged) / sample_rate
+
+def iter_audio_blocks(audio_clip, block_size, total_size, sample_rate=44100):
+    """
+    Stream an audio clip as consecutive mono blocks of block_size samples,
+    zero-padded up to total_size, without decoding the whole clip at once
+    """
+    buffer = np.zeros(0)
+    emitted = 0
+    for chunk in audio_clip.iter_chunks(chunksize=block_size, fps=sample_rate):
+        if len(chunk.shape) > 1:
+            chunk = np.mean(chunk, axis=1)
+        buffer = np.concatenate([buffer, chunk])
+        while len(buffer) >= block_size and emitted + block_size <= total_size:
+            yield buffer[:block_size]
+            buffer = buffer[block_size:]
+            emitted += block_size
+
+    while emitted < total_size:
+        size = min(block_size, total_size - emitted)
+        block = np.zeros(size)
+        tail = buffer[:size]
+        block[:len(tail)] = tail
+        buffer = buffer[size:]
+        yield block
+        emitted += size
+
+def merge_audio_frames(frames1, frames2, window):
+    """
+    Vectorized version of the per-window spectral merge in smart_audio_merge.
+    frames1, frames2: (n, window_size) arrays of analysis windows; returns windowed output frames
+    """
+    window_size = frames1.shape[1]
+
+    # Calculate SNR for each window
+    noise_floor1 = np.mean(np.sort(np.abs(frames1), axis=1)[:, :window_size//10], axis=1)
+    noise_floor2 = np.mean(np.sort(np.abs(frames2), axis=1)[:, :window_size//10], axis=1)
+    snr1 = np.mean(np.abs(frames1), axis=1) / (noise_floor1 + 1e-10)
+    snr2 = np.mean(np.abs(frames2), axis=1) / (noise_floor2 + 1e-10)
+
+    # Calculate spectral content and flatness
+    fft1 = np.fft.rfft(frames1, axis=1)
+    spec1 = np.abs(fft1)
+    spec2 = np.abs(np.fft.rfft(frames2, axis=1))
+    flatness1 = np.exp(np.mean(np.log(spec1 + 1e-10), axis=1)) / (np.mean(spec1, axis=1) + 1e-10)
+    flatness2 = np.exp(np.mean(np.log(spec2 + 1e-10), axis=1)) / (np.mean(spec2, axis=1) + 1e-10)
 
-    return AudioArrayClip(merged_stereo, fps=sample_rate)
+    # Dynamic weights, normalized per window
+    weight1 = snr1 * (1 - flatness1)
+    weight2 = snr2 * (1 - flatness2)
+    total_weight = weight1 + weight2
+    valid = total_weight > 0
+    safe_total = np.where(valid, total_weight, 1.0)
+    weight1 = np.where(valid, weight1 / safe_total, 0.5)[:, None]
+    weight2 = np.where(valid, weight2 / safe_total, 0.5)[:, None]
+
+    # Apply spectral masking and reconstruct with the phase of the first stream
+    freq_mask = np.where(spec1 > spec2, weight1, weight2)
+    merged_spec = spec1 * freq_mask + spec2 * (1 - freq_mask)
+    merged_frames = np.fft.irfft(merged_spec * np.exp(1j * np.angle(fft1)), n=window_size, axis=1)
+
+    return merged_frames * window
+
+def smart_audio_merge_windowed(audio1, audio2, output_path, window_duration, overlap=2.0,
+                               sample_rate=44100,
+                               noise_reduction=0.05,
+                               low_cut=80,
+                               high_cut=8000,
+                               compression_threshold=0.7,
+                               compression_ratio=0.8):
+    """
+    Windowed equivalent of smart_audio_merge for long episodes.
+    Inputs are streamed in blocks of window_duration seconds; the overlap-add tail is carried
+    across block edges and the enhancement filters run on blocks padded by `overlap` seconds.
+    Intermediate signals live in disk-backed memmaps, so peak memory is bounded by the window.
+    Returns the merged duration in seconds.
+    """
+    window_size = 1024
+    hop_length = 512
+    window = np.hanning(window_size)
+    block_size = max(hop_length, int(window_duration * sample_rate) // hop_length * hop_length)
+    margin = int(overlap * sample_rate)
+
+    total_size = max(int(sample_rate * audio1.duration), int(sample_rate * audio2.duration))
+    total_frames = len(range(0, total_size - window_size, hop_length))
+
+    work_dir = os.path.dirname(os.path.abspath(output_path))
+    ola_path = os.path.join(work_dir, "merge_ola.f32")
+    enhanced_path = os.path.join(work_dir, "merge_enhanced.f32")
+    merged = np.memmap(ola_path, dtype=np.float32, mode='w+', shape=(total_size,))
+
+    # Pass 1: spectral merge with overlap-add, carrying the unfinished tail between blocks
+    pending1 = np.zeros(0)
+    pending2 = np.zeros(0)
+    base = 0
+    frames_done = 0
+    ola_tail = np.zeros(hop_length)
+    peak = 0.0
+    for block1, block2 in zip(iter_audio_blocks(audio1, block_size, total_size, sample_rate),
+                              iter_audio_blocks(audio2, block_size, total_size, sample_rate)):
+        pending1 = np.concatenate([pending1, block1])
+        pending2 = np.concatenate([pending2, block2])
+        if len(pending1) < window_size:
+            continue
+
+        count = min((len(pending1) - window_size) // hop_length + 1, total_frames - frames_done)
+        if count > 0:
+            frames1 = np.lib.stride_tricks.sliding_window_view(pending1, window_size)[::hop_length][:count]
+            frames2 = np.lib.stride_tricks.sliding_window_view(pending2, window_size)[::hop_length][:count]
+            merged_frames = merge_audio_frames(frames1, frames2, window)
+
+            # hop is half a window, so even and odd frames each tile without overlapping
+            ola = np.zeros(count * hop_length + hop_length)
+            even = merged_frames[0::2].ravel()
+            odd = merged_frames[1::2].ravel()
+            ola[:len(even)] += even
+            ola[hop_length:hop_length + len(odd)] += odd
+            ola[:hop_length] += ola_tail
+
+            done = count * hop_length
+            merged[base:base + done] = ola[:done]
+            peak = max(peak, np.max(np.abs(ola[:done])))
+            ola_tail = ola[done:]
+
+            base += done
+            frames_done += count
+            pending1 = pending1[done:]
+            pending2 = pending2[done:]
+
+    end = min(total_size, base + hop_length)
+    merged[base:end] = ola_tail[:end - base]
+    if end > base:
+        peak = max(peak, np.max(np.abs(ola_tail[:end - base])))
+    merged.flush()
+
+    # Pass 2: enhancement on margin-padded blocks, keeping only the block core
+    nyquist = sample_rate / 2
+    b, a = butter(2, [low_cut / nyquist, high_cut / nyquist], btype='band')
+    enhanced = np.memmap(enhanced_path, dtype=np.float32, mode='w+', shape=(total_size,))
+    enhanced_peak = 0.0
+    for start in range(0, total_size, block_size):
+        stop = min(total_size, start + block_size)
+        padded_start = max(0, start - margin)
+        padded_stop = min(total_size, stop + margin)
+        segment = np.asarray(merged[padded_start:padded_stop], dtype=np.float64) / peak
+
+        noise_reduced = segment * (1 - noise_reduction) + medfilt(segment, kernel_size=3) * noise_reduction
+        filtered = filtfilt(b, a, noise_reduced)[start - padded_start:stop - padded_start]
+
+        above_threshold = filtered > compression_threshold
+        filtered[above_threshold] = compression_threshold + (filtered[above_threshold] - compression_threshold) * compression_ratio
+
+        enhanced[start:stop] = filtered
+        enhanced_peak = max(enhanced_peak, np.max(np.abs(filtered)))
+    enhanced.flush()
+    del merged
+
+    # Pass 3: normalize and stream to a 16-bit PCM WAV
+    with wave.open(output_path, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        for start in range(0, total_size, block_size):
+            block = np.asarray(enhanced[start:start + block_size], dtype=np.float64) / enhanced_peak
+            wav.writeframes((np.clip(block, -1.0, 1.0) * 32767).astype('<i2').tobytes())
+    del enhanced
+
+    os.remove(ola_path)
+    os.remove(enhanced_path)
+    return total_size / sample_rate
 
 def find_audio_peaks(audio_array):
     """
@@ -407,191 +642,715 @@ def analyze_audio_characteristics(audio_array, sample_rate=44100):
         'c50': c50
     }
 
-def process_videos(left_camera, main_camera, right_camera, left_audio, right_audio, output_path, 
-                  speaker_bias={'left': 1.2, 'main': 1.0, 'right': 1.0},
-                  min_clip_duration=20.0,
-                  audio_params=None,
-                  merge_audio=True):
+def analyze_audio_windows(audio_clip, window_duration, count=3):
     """
-    Process videos with configurable parameters
-    audio_params: dict with keys for audio processing settings
-    merge_audio: bool, whether to merge audio or use individual audio tracks
+    Windowed audio analysis: run analyze_audio_characteristics on `count` excerpts spread
+    over the clip instead of the whole episode, keeping the most conservative settings
     """
-    try:
-        print("Starting video processing...")
-        
-        # Sync audio with videos
-        print("Syncing left camera...")
-        left_synced = sync_audio_with_video(left_camera, left_audio)
-        print("Syncing main camera...")
-        main_synced = sync_audio_with_video(main_camera, left_audio)
-        print("Syncing right camera...")
-        right_synced = sync_audio_with_video(right_camera, right_audio)
-
-        # Sync cameras
-        print("Syncing all cameras together...")
-        left_synced, main_synced, right_synced = sync_cameras(left_synced, main_synced, right_synced)
-
-        if merge_audio:
-            print("Analyzing audio characteristics...")
-            # Convert audio to arrays for analysis
-            left_array = audio_to_array(left_synced.audio)
-            right_array = audio_to_array(right_synced.audio)
-            
-            # Analyze both audio tracks
-            left_analysis = analyze_audio_characteristics(left_array)
-            right_analysis = analyze_audio_characteristics(right_array)
-            
-            # Use the more conservative compression settings
-            optimal_compression = {
-                'compression_threshold': max(left_analysis['compression_threshold'], 
-                                          right_analysis['compression_threshold']),
-                'compression_ratio': max(left_analysis['compression_ratio'], 
-                                       right_analysis['compression_ratio'])
-            }
-            
-            print(f"Optimal compression parameters determined: {optimal_compression}")
-            
-            # Update audio_params with analyzed compression settings
-            if audio_params is None:
-                audio_params = {}
-            audio_params.update(optimal_compression)
-            
-            # Use smart audio merging with provided parameters
-            print("Merging audio tracks...")
-            merged_audio = smart_audio_merge(
-                left_synced.audio, 
-                right_synced.audio,
-                **audio_params
-            )
-            
-            # Apply merged audio to all clips
-            left_synced = left_synced.set_audio(merged_audio)
-            main_synced = main_synced.set_audio(merged_audio)
-            right_synced = right_synced.set_audio(merged_audio)
-        else:
-            print("Using individual audio tracks...")
-            # Keep original audio for each video
-            pass
+    starts = np.linspace(0, max(0, audio_clip.duration - window_duration), count)
+    analyses = []
+    for start in starts:
+        excerpt = audio_to_array(audio_clip.subclip(start, min(audio_clip.duration, start + window_duration)))
+        analyses.append(analyze_audio_characteristics(excerpt))
+        del excerpt
+    return {
+        'compression_threshold': max(a['compression_threshold'] for a in analyses),
+        'compression_ratio': max(a['compression_ratio'] for a in analyses)
+    }
 
-        # Get minimum duration considering both video and audio for each clip
-        left_duration = min(left_synced.duration, left_synced.audio.duration if left_synced.audio else float('inf'))
-        main_duration = min(main_synced.duration, main_synced.audio.duration if main_synced.audio else float('inf'))
-        right_duration = min(right_synced.duration, right_synced.audio.duration if right_synced.audio else float('inf'))
+# Part of the scoring cache key: bump whenever score_frames / the lip-activity backends
+# change what they compute, so cached scores from older logic are not reused
+SCORING_VERSION = 3
 
-        # Use the shortest duration among all clips
-        min_duration = min(left_duration, main_duration, right_duration)
+# Lip-activity backend (see lip_activity.py) unless QARIO_LIP_BACKEND picks another
+LIP_BACKEND = "variance"
 
-        # Trim videos to the shortest duration that has both audio and video
-        left_synced = left_synced.subclip(0, min_duration)
-        main_synced = main_synced.subclip(0, min_duration)
-        right_synced = right_synced.subclip(0, min_duration)
+def score_frame_slots(task):
+    """
+    Pool task: faces of the cameras flagged in detect, for the three cameras' frames at
+    one timestamp held in their rings (see SharedFrameRing.ref), as (box, landmarks) lists with None for
+    cameras that were not detected.
+    """
+    t, slots, detect = task
+    frames = [frame_of(ref) for (ref, _), flag in zip(slots, detect) if flag]
+    # Changed cameras go through the detector together (one forward pass with the SSD backend)
+    detected = iter(detect_faces_with_landmarks_batch(frames))
+    return [next(detected) if flag else None for flag in detect]
 
-        print(f"Adjusted duration: {min_duration}")
-        print(f"Left synced - Duration: {left_synced.duration}, FPS: {left_synced.fps}")
-        print(f"Main synced - Duration: {main_synced.duration}, FPS: {main_synced.fps}")
-        print(f"Right synced - Duration: {right_synced.duration}, FPS: {right_synced.fps}")
+def score_frames(left_synced, main_synced, right_synced, duration, stage=None):
+    """
+    Measure mouth movement on every frame of the three synced cameras.
+    Returns (times, movement) where movement has one column per camera, without speaker bias.
+    stage: optional reporting.Stage that receives frame counts, throttled progress and
+    the detector call rate
+
+    Frames are copied into one shared-memory ring per camera and detection runs in a
+    worker pool that only receives slot indices; the rings bound the frames in flight.
+    A camera whose frame hasn't changed outside the mouths since its last detection
+    (see FrameChangeGate) keeps its previous faces. Mouth movement is measured here, in
+    frame order, by one lip-activity backend per camera (see lip_activity.py); backends
+    that find their own faces skip the detector altogether.
+    """
+    clips = (left_synced, main_synced, right_synced)
+    fps = main_synced.fps
+    times = []
+    movement = []
 
-        # Process frames and swap based on speaker detection
-        clips = []
-        current_speaker = 1  # Start with main camera
-        segment_start = 0
-        min_clip_duration = min_clip_duration  # Minimum clip duration in seconds
+    print(f"Processing frames for {duration} seconds...")
+    pool = get_pool(warmups=(warm_up_detectors,))
+    # The three cameras' rings share one shared-memory budget
+    rings = [make_frame_ring((clip.h, clip.w, 3), POOL_PROCESSES * 2 + 2, rings=len(clips)) for clip in clips]
+    gates = [FrameChangeGate() for _ in clips]
+    activities = [make_lip_activity(lip_backend(LIP_BACKEND)) for _ in clips]
 
-        print(f"Processing frames for {min_duration} seconds...")
-        for t in np.arange(0, min_duration, 1/main_synced.fps):
+    def produce():
+        for t in np.arange(0, duration, 1/fps):
             # Ensure we don't go beyond the clip duration
-            if t >= min_duration - 1/main_synced.fps:
+            if t >= duration - 1/fps:
                 break
 
             try:
-                left_frame = left_synced.get_frame(t)
-                main_frame = main_synced.get_frame(t)
-                right_frame = right_synced.get_frame(t)
+                frames = [clip.get_frame(t) for clip in clips]
             except Exception as e:
                 print(f"Error getting frame at time {t}: {str(e)}")
                 break
 
-            left_movement = detect_mouth_movement(left_frame) * speaker_bias['left']
-            main_movement = detect_mouth_movement(main_frame) * speaker_bias['main']
-            right_movement = detect_mouth_movement(right_frame) * speaker_bias['right']
+            slots = []
+            for ring, frame in zip(rings, frames):
+                slot = ring.acquire()
+                if slot is None:
+                    return
+                ring.frames[slot] = frame
+                slots.append((ring.ref(slot), slot))
+            # Per-camera decisions are filled in by decide(), once each camera's gate can tell
+            yield t, slots, [None] * len(clips)
 
-            new_speaker = 1  # default to main
-            if left_movement > right_movement and left_movement > main_movement:
-                new_speaker = 0
-            elif right_movement > left_movement and right_movement > main_movement:
-                new_speaker = 2
-            
-            # Only create a new clip when speaker changes and the previous clip is long enough
-            if new_speaker != current_speaker and (t - segment_start) >= min_clip_duration:
-                # Add the clip up to this point
-                clip_end = t
-                try:
-                    if current_speaker == 0:
-                        clip = left_synced.subclip(segment_start, clip_end)
-                    elif current_speaker == 2:
-                        clip = right_synced.subclip(segment_start, clip_end)
-                    else:
-                        clip = main_synced.subclip(segment_start, clip_end)
-                    
-                    # Ensure audio is included in the clip
-                    if clip.audio is None:
-                        print(f"Warning: No audio in clip from {segment_start} to {clip_end}")
-                    
-                    # Resize clip to match main_synced's aspect ratio
-                    clip = resize_clip(clip, main_synced.w, main_synced.h)
-                    
-                    clips.append(clip.set_fps(main_synced.fps))
-                except Exception as e:
-                    print(f"Error creating subclip from {segment_start} to {clip_end}: {str(e)}")
-                    break
-                
-                segment_start = clip_end
-                current_speaker = new_speaker
+    def decide(task):
+        t, slots, detect = task
+        if activities[0].finds_faces:
+            return False
+        for camera, (gate, (_, slot)) in enumerate(zip(gates, slots)):
+            if detect[camera] is None:
+                detect[camera] = gate.needs_detection(rings[camera].frames[slot], key=t)
+        if None in detect:
+            return None
+        for camera, flag in enumerate(detect):
+            if not flag:
+                # Nothing to send for cameras that keep their faces (pickled rings copy the frame)
+                slots[camera] = (None, slots[camera][1])
+        return any(detect)
+
+    last_faces = [[] for _ in clips]
+    try:
+        # The gates run in this thread, between results, so each compares against the
+        # mouth regions of its own reference frame
+        for (t, slots, detect), result in gated_imap(pool, score_frame_slots, produce(), decide,
+                                                     min(ring.slots for ring in rings) - 1):
+            faces = result if result is not None else [None] * len(clips)
+            frame_scores = []
+            for camera, (ring, (_, slot)) in enumerate(zip(rings, slots)):
+                if faces[camera] is not None:
+                    last_faces[camera] = faces[camera]
+                    gates[camera].set_mouth_regions(t, [mouth_region_bounds(*face) for face in faces[camera]])
+                boxes = [box for box, _ in last_faces[camera]]
+                landmarks = [face_landmarks for _, face_landmarks in last_faces[camera]]
+                measured = activities[camera].measure(ring.frames[slot], t, boxes, landmarks)
+                frame_scores.append(largest_face_score(measured))
+                ring.release(slot)
+            times.append(t)
+            movement.append(frame_scores)
+            if stage is not None:
+                stage.add_frames(3)
+                stage.progress(t / duration)
+    finally:
+        for ring in rings:
+            ring.close()
+        for activity in activities:
+            activity.close()
+
+    if stage is not None:
+        calls = sum(gate.detections for gate in gates)
+        frames = sum(gate.frames for gate in gates)
+        stage.set_metric("detector_call_rate", round(calls / frames, 3) if frames else 0.0)
+
+    return np.array(times), np.array(movement, dtype=np.float64).reshape(-1, 3)
+
+# Faces embedded per camera to check a new set of inputs against the last camera map
+VERIFY_SAMPLES = 2
+
+def camera_embeddings(synced_clips, times):
+    """{camera: (n, 128) embeddings of its largest face at each of times}, one detector batch per camera"""
+    groups = {}
+    for camera, clip in zip(CAMERA_NAMES, synced_clips):
+        frames = [clip.get_frame(t) for t in times]
+        embeddings = []
+        for frame, faces in zip(frames, detect_faces_with_landmarks_batch(frames)):
+            if not faces:
+                continue
+            largest_face = max((box for box, _ in faces), key=lambda box: (box[2] - box[0]) * (box[1] - box[3]))
+            embeddings.extend(face_embeddings(frame, [largest_face]))
+        groups[camera] = np.array(embeddings).reshape(-1, 128)
+    return groups
+
+def identify_cameras(synced_clips, duration, identities, input_key, samples=8):
+    """
+    Which known speaker each camera covers. Returns ({camera: speaker_id}, faces embedded).
+
+    Maps are remembered in the project's identities per set of camera inputs (input_key):
+    a rerun on the same inputs reuses its map without embedding anything, and new inputs
+    (the next episode) are first checked with VERIFY_SAMPLES faces per camera against the
+    last map, which is kept when every camera still shows its speaker. Otherwise the
+    largest face of every camera is embedded at `samples` times spread over the episode
+    and each camera's embeddings are matched as one group (see SpeakerIdentities.identify).
+    """
+    known = identities.cameras.get(input_key)
+    if known is not None:
+        identities.remember_cameras(input_key, known)
+        return known, 0
+
+    embedded = 0
+    last = identities.last_cameras()
+    if last:
+        groups = camera_embeddings(synced_clips, np.linspace(0, duration, VERIFY_SAMPLES + 2)[1:-1])
+        embedded += sum(len(embeddings) for embeddings in groups.values())
+        seen = {camera: embeddings for camera, embeddings in groups.items() if len(embeddings)}
+        if seen and all(camera in last and identities.matches(last[camera], embeddings)
+                        for camera, embeddings in seen.items()):
+            identities.remember_cameras(input_key, last)
+            return last, embedded
+
+    groups = camera_embeddings(synced_clips, np.linspace(0, duration, samples + 2)[1:-1])
+    embedded += sum(len(embeddings) for embeddings in groups.values())
+    camera_speakers = identities.identify(groups)
+    identities.remember_cameras(input_key, camera_speakers)
+    return camera_speakers, embedded
+
+def decide_segments(times, movement, duration, fps, speaker_bias, min_clip_duration):
+    """
+    Turn per-frame movement scores into camera segments.
+    Returns a list of {'camera': index, 'start', 'end'} covering [0, duration].
+    """
+    bias = np.array([speaker_bias[camera] for camera in CAMERA_NAMES])
+    segments = []
+    current_speaker = 1  # Start with main camera
+    segment_start = 0
 
-        # Add the final clip
+    for t, scores in zip(times, movement * bias):
+        if t >= duration - 1/fps:
+            break
+
+        left_movement, main_movement, right_movement = scores
+        new_speaker = 1  # default to main
+        if left_movement > right_movement and left_movement > main_movement:
+            new_speaker = 0
+        elif right_movement > left_movement and right_movement > main_movement:
+            new_speaker = 2
+
+        # Only create a new clip when speaker changes and the previous clip is long enough
+        if new_speaker != current_speaker and (t - segment_start) >= min_clip_duration:
+            segments.append({'camera': current_speaker, 'start': float(segment_start), 'end': float(t)})
+            segment_start = t
+            current_speaker = new_speaker
+
+    # Add the final clip
+    segments.append({'camera': current_speaker, 'start': float(segment_start), 'end': float(duration)})
+    return segments
+
+def build_edit(segments, synced_clips):
+    """
+    Cut the synced cameras according to segments and concatenate them into one clip
+    """
+    main_synced = synced_clips[1]
+    clips = []
+
+    for segment in segments:
         try:
-            if current_speaker == 0:
-                clip = left_synced.subclip(segment_start, min_duration)
-            elif current_speaker == 2:
-                clip = right_synced.subclip(segment_start, min_duration)
-            else:
-                clip = main_synced.subclip(segment_start, min_duration)
-            
-            # Ensure audio is included in the final clip
-            if clip.audio is None:
-                print(f"Warning: No audio in final clip from {segment_start} to {min_duration}")
-            
-            # Resize final clip to match main_synced's aspect ratio
+            clip = synced_clips[segment['camera']].subclip(segment['start'], segment['end'])
+
+            # Ensure audio is included in the clip
+            if main_synced.audio is not None and clip.audio is None:
+                print(f"Warning: No audio in clip from {segment['start']} to {segment['end']}")
+
+            # Resize clip to match main_synced's aspect ratio
             clip = resize_clip(clip, main_synced.w, main_synced.h)
-            
+
             clips.append(clip.set_fps(main_synced.fps))
         except Exception as e:
-            print(f"Error adding final clip: {str(e)}")
+            print(f"Error creating subclip from {segment['start']} to {segment['end']}: {str(e)}")
+            break
 
-        print(f"Number of clips generated: {len(clips)}")
+    print(f"Number of clips generated: {len(clips)}")
 
-        if not clips:
-            print("No clips were generated. Using main video as fallback.")
-            final_video = main_synced
-        else:
-            print("Concatenating clips...")
-            print(clips)
-            final_video = concatenate_videoclips(clips, method="compose")
+    if not clips:
+        print("No clips were generated. Using main video as fallback.")
+        return main_synced
+
+    print("Concatenating clips...")
+    print(clips)
+    return concatenate_videoclips(clips, method="compose")
 
+def write_edit(final_video, output_path, fps, with_audio):
+    if with_audio:
+        print(f"Writing final video to {output_path}...")
+        final_video.write_videofile(output_path, fps=fps, audio_codec='aac', audio=True)
+    else:
+        print(f"Writing video stream to {output_path}...")
+        final_video.write_videofile(output_path, fps=fps, audio=False)
+
+def concat_files(part_paths, output_path):
+    """
+    Join rendered parts with the ffmpeg concat demuxer (stream copy, no re-encode)
+    """
+    list_path = os.path.splitext(output_path)[0] + "_parts.txt"
+    with open(list_path, 'w') as f:
+        for path in part_paths:
+            f.write(f"file '{os.path.abspath(path)}'\n")
+    ffmpeg_cmd = [
+        "ffmpeg", "-y",
+        "-f", "concat",
+        "-safe", "0",
+        "-i", list_path,
+        "-c", "copy",
+        output_path
+    ]
+    subprocess.run(ffmpeg_cmd, check=True)
+    os.remove(list_path)
+    return output_path
+
+def render_segments(segments, synced_clips, output_path, merged_audio_path=None):
+    """
+    Cut the synced cameras according to segments and write the final edit.
+    With merged_audio_path the video is rendered silent and the merged mix is muxed in.
+    """
+    main_synced = synced_clips[1]
+    final_video = build_edit(segments, synced_clips)
+
+    if merged_audio_path is not None:
+        # Render video only, then take audio from the merged mix on disk
+        video_only_path = os.path.splitext(output_path)[0] + "_video_only.mp4"
+        write_edit(final_video, video_only_path, main_synced.fps, with_audio=False)
+        print(f"Muxing merged audio into {output_path}...")
+        mux_audio(video_only_path, merged_audio_path, output_path)
+        os.remove(video_only_path)
+    else:
         # Ensure the final video has audio
         if final_video.audio is None:
             print("Warning: Final video has no audio. Attempting to add audio from main video.")
             final_video = final_video.set_audio(main_synced.audio)
 
-        print(f"Writing final video to {output_path}...")
-        final_video.write_videofile(output_path, fps=main_synced.fps, audio_codec='aac', audio=True)
+        write_edit(final_video, output_path, main_synced.fps, with_audio=True)
+
+def write_edit_audio(segments, synced_clips, output_path, sample_rate=44100):
+    """
+    Write the audio of the edit as one continuous WAV: each segment's camera audio, cut
+    on the same timeline as the video. Cameras without audio fall back to the main camera.
+    """
+    main_synced = synced_clips[1]
+    pieces = []
+    for segment in segments:
+        audio = synced_clips[segment['camera']].audio
+        if audio is None:
+            audio = main_synced.audio
+        if audio is None:
+            continue
+        pieces.append(audio.subclip(segment['start'], segment['end']))
+    if not pieces:
+        return None
+    print(f"Writing edit audio to {output_path}...")
+    concatenate_audioclips(pieces).write_audiofile(output_path, fps=sample_rate)
+    return output_path
+
+def render_segments_windowed(segments, synced_clips, output_path, window_duration, cache, decisions_key,
+                             merged_audio_path=None):
+    """
+    Render the edit one time window at a time and join the parts.
+    Each part only holds the clip graph for its own window and is checkpointed on its own,
+    so a failed render resumes from the first missing window.
+    Parts are video only: per-part AAC tracks would leave priming gaps at every join, so one
+    continuous track (the merged mix, or the cameras' own audio) is muxed in at the end.
+    """
+    main_synced = synced_clips[1]
+    duration = segments[-1]['end']
+    part_paths = []
+
+    for index, window_start in enumerate(np.arange(0, duration, window_duration)):
+        window_end = min(duration, window_start + window_duration)
+        part_segments = [
+            {'camera': segment['camera'],
+             'start': max(segment['start'], window_start),
+             'end': min(segment['end'], window_end)}
+            for segment in segments
+            if segment['start'] < window_end and segment['end'] > window_start
+        ]
+
+        part_key = cache.key("render_part", decisions=decisions_key, window=[window_start, window_end])
+        manifest = cache.load("render_part", part_key)
+        if manifest:
+            print(f"Render window {index}: reusing cached part")
+            part_paths.append(manifest['artifacts']['part']['path'])
+            continue
+
+        print(f"Render window {index}: {window_start:.2f}s - {window_end:.2f}s")
+        part_path = cache.artifact_path("render_part", part_key, "part.mp4")
+        part_video = build_edit(part_segments, synced_clips)
+        write_edit(part_video, part_path, main_synced.fps, with_audio=False)
+        cache.save("render_part", part_key, {'part': part_path})
+        part_paths.append(part_path)
+
+    audio_path = merged_audio_path
+    if audio_path is None:
+        audio_key = cache.key("render_audio", decisions=decisions_key)
+        manifest = cache.load("render_audio", audio_key)
+        if manifest:
+            audio_path = manifest['artifacts']['audio']['path']
+        else:
+            audio_path = write_edit_audio(segments, synced_clips,
+                                          cache.artifact_path("render_audio", audio_key, "audio.wav"))
+            if audio_path is not None:
+                cache.save("render_audio", audio_key, {'audio': audio_path})
+
+    if audio_path is not None:
+        video_only_path = os.path.splitext(output_path)[0] + "_video_only.mp4"
+        concat_files(part_paths, video_only_path)
+        print(f"Muxing audio into {output_path}...")
+        mux_audio(video_only_path, audio_path, output_path)
+        os.remove(video_only_path)
+    else:
+        print("Warning: No camera has audio; the output is video only.")
+        concat_files(part_paths, output_path)
+
+@dataclass
+class ProcessingConfig:
+    """
+    Inputs and parameters of one sync/detect/swap run.
+    audio_params: dict with keys for audio processing settings
+    merge_audio: bool, whether to merge audio or use individual audio tracks
+    cache_dir: where stage artifacts are checkpointed across runs, owned (and cleaned up) by
+    the caller, who keys it per job; without one the stages use a cache beside output_path
+    that is kept when the run fails, so a retry resumes, and removed once it succeeds
+    window_duration: seconds per window for long episodes; None processes the whole timeline at once
+    window_overlap: seconds of context added on each side of a window for the audio filters
+    """
+    left_camera: str
+    main_camera: str
+    right_camera: str
+    left_audio: str
+    right_audio: str
+    output_path: str
+    project_id: str = None
+    speaker_bias: dict = field(default_factory=lambda: {'left': 1.2, 'main': 1.0, 'right': 1.0})
+    min_clip_duration: float = 20.0
+    audio_params: dict = None
+    merge_audio: bool = True
+    cache_dir: str = None
+    window_duration: float = None
+    window_overlap: float = 2.0
+
+    @property
+    def input_paths(self):
+        return [self.left_camera, self.main_camera, self.right_camera, self.left_audio, self.right_audio]
+
+    def validate(self):
+        for file_path in self.input_paths:
+            if not os.path.exists(file_path):
+                raise FileNotFoundError(f"File not found: {file_path}")
+
+    @classmethod
+    def from_params(cls, left_camera, main_camera, right_camera, left_audio, right_audio, output_path,
+                    project_id=None, processing_params=None):
+        """
+        Build a config from the JSON processing params sent by the Node service
+        """
+        processing_params = processing_params or {}
+        config = cls(left_camera, main_camera, right_camera, left_audio, right_audio, output_path,
+                     project_id=project_id,
+                     min_clip_duration=1.0,
+                     audio_params={
+                         'noise_reduction': 0.05,
+                         'low_cut': 80,
+                         'high_cut': 8000
+                         # compression parameters will be determined automatically
+                     })
+
+        if 'speaker_bias' in processing_params:
+            config.speaker_bias.update(processing_params['speaker_bias'])
+        if 'min_clip_duration' in processing_params:
+            config.min_clip_duration = float(processing_params['min_clip_duration'])
+        if 'merge_audio' in processing_params:
+            config.merge_audio = bool(processing_params['merge_audio'])
+        if 'audio_params' in processing_params:
+            config.audio_params.update(processing_params['audio_params'])
+        if 'cache_dir' in processing_params:
+            config.cache_dir = processing_params['cache_dir']
+        if processing_params.get('window_duration'):
+            config.window_duration = float(processing_params['window_duration'])
+        if 'window_overlap' in processing_params:
+            config.window_overlap = float(processing_params['window_overlap'])
+        return config
+
+@dataclass
+class ProcessingResult:
+    output_path: str
+    duration: float
+    sync: dict
+    segments: list
+    stage_timings: dict
+    merged_audio_path: str = None
+    # Camera name -> speaker ID in the project's identity cache (see speaker_identity.py); empty without a project
+    camera_speakers: dict = None
+
+    def to_dict(self):
+        return asdict(self)
+
+def run(config):
+    """
+    Run the full pipeline in-process and return a ProcessingResult.
+
+    The work runs as stages (sync, audio merge, scoring, identity, decisions, render). Each stage
+    stores its artifact under a key derived from its inputs, so a rerun with the same
+    inputs and parameters resumes after the last stage that completed.
+
+    In windowed mode sync offsets are found on the first window and applied to the whole
+    timeline, the audio merge streams block by block, and the render is split into parts,
+    so peak memory is bounded by the window size rather than the episode length.
+    """
+    output_path = os.path.abspath(config.output_path)
+    cache_dir = config.cache_dir
+    if cache_dir is None:
+        # Named after the output, so concurrent jobs writing to one directory don't share it
+        cache_dir = output_path + ".stages"
+    try:
+        print("Starting video processing...")
+        config.validate()
+
+        window_duration = config.window_duration
+        cache = StageCache(cache_dir)
+        input_paths = config.input_paths
+        fingerprints = [file_fingerprint(path) for path in input_paths]
+        stage_timings = {}
+
+        # Stage 1: decode and sync
+        with Stage("sync") as stage:
+            sync_key = cache.key("sync", inputs=fingerprints, analysis_duration=window_duration)
+            manifest = cache.load("sync", sync_key)
+            if manifest:
+                print("Sync stage: reusing cached offsets")
+                sync = load_json(manifest['artifacts']['sync']['path'])
+                left_synced, main_synced, right_synced, sync = open_synced_cameras(*input_paths, sync=sync)
+            else:
+                left_synced, main_synced, right_synced, sync = open_synced_cameras(
+                    *input_paths, analysis_duration=window_duration)
+                cache.save("sync", sync_key, {
+                    'sync': save_json(cache.artifact_path("sync", sync_key, "sync.json"), sync)
+                })
+        stage_timings['sync'] = stage.duration
+
+        # Stage 2: audio merge
+        with Stage("audio_merge") as stage:
+            merged_audio_path = None
+            merge_key = None
+            if config.merge_audio:
+                merge_key = cache.key("audio_merge", sync=sync_key, audio_params=config.audio_params,
+                                      window_duration=window_duration, window_overlap=config.window_overlap)
+                manifest = cache.load("audio_merge", merge_key)
+                if manifest:
+                    print("Audio merge stage: reusing cached mix")
+                    merged_audio_path = manifest['artifacts']['merged_audio']['path']
+                    merged_duration = manifest['metadata']['duration']
+                else:
+                    print("Analyzing audio characteristics...")
+                    if window_duration:
+                        left_analysis = analyze_audio_windows(left_synced.audio, window_duration)
+                        right_analysis = analyze_audio_windows(right_synced.audio, window_duration)
+                    else:
+                        # Convert audio to arrays for analysis
+                        left_array = audio_to_array(left_synced.audio)
+                        right_array = audio_to_array(right_synced.audio)
+                    
+                        # Analyze both audio tracks
+                        left_analysis = analyze_audio_characteristics(left_array)
+                        right_analysis = analyze_audio_characteristics(right_array)
+                        del left_array, right_array
+                
+                    # Use the more conservative compression settings
+                    optimal_compression = {
+                        'compression_threshold': max(left_analysis['compression_threshold'], 
+                                                  right_analysis['compression_threshold']),
+                        'compression_ratio': max(left_analysis['compression_ratio'], 
+                                               right_analysis['compression_ratio'])
+                    }
+                
+                    print(f"Optimal compression parameters determined: {optimal_compression}")
+                
+                    # Update audio_params with analyzed compression settings
+                    merge_params = dict(config.audio_params or {})
+                    merge_params.update(optimal_compression)
+                
+                    # Use smart audio merging with provided parameters
+                    print("Merging audio tracks...")
+                    merged_audio_path = cache.artifact_path("audio_merge", merge_key, "merged_audio.wav")
+                    if window_duration:
+                        merged_duration = smart_audio_merge_windowed(
+                            left_synced.audio,
+                            right_synced.audio,
+                            merged_audio_path,
+                            window_duration,
+                            config.window_overlap,
+                            **merge_params
+                        )
+                    else:
+                        merged_duration = smart_audio_merge(
+                            left_synced.audio, 
+                            right_synced.audio,
+                            merged_audio_path,
+                            **merge_params
+                        )
+                    cache.save("audio_merge", merge_key, {'merged_audio': merged_audio_path},
+                               metadata={'duration': merged_duration, 'audio_params': merge_params})
+                    stage.media_duration = merged_duration
+                print(f"Merged audio at {merged_audio_path} ({merged_duration:.2f}s)")
+            
+                # The edit is rendered without audio and the merged mix is muxed in at the end
+                left_synced = left_synced.without_audio()
+                main_synced = main_synced.without_audio()
+                right_synced = right_synced.without_audio()
+            else:
+                print("Using individual audio tracks...")
+                # Keep original audio for each video
+                pass
+        stage_timings['audio_merge'] = stage.duration
+
+        # Get minimum duration considering both video and audio for each clip
+        left_duration = min(left_synced.duration, left_synced.audio.duration if left_synced.audio else float('inf'))
+        main_duration = min(main_synced.duration, main_synced.audio.duration if main_synced.audio else float('inf'))
+        right_duration = min(right_synced.duration, right_synced.audio.duration if right_synced.audio else float('inf'))
+
+        # Use the shortest duration among all clips
+        video_duration = min(left_duration, main_duration, right_duration)
+        min_duration = video_duration
+        if config.merge_audio:
+            min_duration = min(min_duration, merged_duration)
+
+        # Trim videos to the shortest duration that has both audio and video
+        left_synced = left_synced.subclip(0, min_duration)
+        main_synced = main_synced.subclip(0, min_duration)
+        right_synced = right_synced.subclip(0, min_duration)
+
+        print(f"Adjusted duration: {min_duration}")
+        print(f"Left synced - Duration: {left_synced.duration}, FPS: {left_synced.fps}")
+        print(f"Main synced - Duration: {main_synced.duration}, FPS: {main_synced.fps}")
+        print(f"Right synced - Duration: {right_synced.duration}, FPS: {right_synced.fps}")
+
+        # Stage 3: per-frame scoring (independent of the audio merge, so it covers the video duration)
+        with Stage("scoring") as stage:
+            scoring_key = cache.key("scoring", sync=sync_key, duration=video_duration, fps=main_synced.fps,
+                                    detector=detector_backend(), lip=lip_backend(LIP_BACKEND), version=SCORING_VERSION)
+            manifest = cache.load("scoring", scoring_key)
+            if manifest:
+                print("Scoring stage: reusing cached movement scores")
+                scores = np.load(manifest['artifacts']['scores']['path'])
+                times, movement = scores['times'], scores['movement']
+            else:
+                stage.media_duration = video_duration
+                times, movement = score_frames(left_synced, main_synced, right_synced, video_duration, stage)
+                scores_path = cache.artifact_path("scoring", scoring_key, "scores.npz")
+                np.savez(scores_path, times=times, movement=movement)
+                cache.save("scoring", scoring_key, {'scores': scores_path})
+        stage_timings['scoring'] = stage.duration
+
+        # Stage 4: which speaker each camera covers, against the speakers known for this project;
+        # skipped without a project, as there is nothing to match against or persist. The
+        # project's identities remember the map per set of camera files, so this is a lookup
+        # on reruns and a quick check on later episodes
+        camera_speakers = {}
+        if config.project_id:
+            with Stage("identity") as stage:
+                identities = SpeakerIdentities(config.project_id)
+                camera_key = cache.key("identity", cameras=fingerprints[:3])
+                camera_speakers, embedded = identify_cameras((left_synced, main_synced, right_synced),
+                                                             video_duration, identities, camera_key)
+                identities.save()
+                stage.set_metric("embedded_faces", embedded)
+                print(f"Camera speakers: {camera_speakers}")
+            stage_timings['identity'] = stage.duration
+
+        # Stage 5: switching decisions
+        with Stage("decisions") as stage:
+            decisions_key = cache.key("decisions", scoring=scoring_key, merge=merge_key, duration=min_duration,
+                                      speaker_bias=config.speaker_bias, min_clip_duration=config.min_clip_duration)
+            manifest = cache.load("decisions", decisions_key)
+            if manifest:
+                print("Decisions stage: reusing cached segments")
+                segments = load_json(manifest['artifacts']['segments']['path'])
+            else:
+                segments = decide_segments(times, movement, min_duration, main_synced.fps,
+                                           config.speaker_bias, config.min_clip_duration)
+                cache.save("decisions", decisions_key, {
+                    'segments': save_json(cache.artifact_path("decisions", decisions_key, "segments.json"), segments)
+                })
+            print(f"Camera segments: {len(segments)}")
+            stage.set_metric("segments", len(segments))
+        stage_timings['decisions'] = stage.duration
+
+        # Stage 6: render
+        with Stage("render") as stage:
+            render_key = cache.key("render", decisions=decisions_key, output=output_path)
+            if cache.load("render", render_key):
+                print(f"Render stage: {output_path} is already up to date")
+            else:
+                stage.media_duration = min_duration
+                synced_clips = (left_synced, main_synced, right_synced)
+                if window_duration:
+                    render_segments_windowed(segments, synced_clips, output_path, window_duration,
+                                             cache, decisions_key, merged_audio_path)
+                else:
+                    render_segments(segments, synced_clips, output_path, merged_audio_path)
+                cache.save("render", render_key, {'output': output_path})
+        stage_timings['render'] = stage.duration
         print("Video processing completed successfully.")
+
+        if config.cache_dir is None:
+            # Only a successful run drops its cache; a failed one is resumed by the retry
+            shutil.rmtree(cache_dir, ignore_errors=True)
+        return ProcessingResult(
+            output_path=output_path,
+            duration=float(min_duration),
+            sync=sync,
+            segments=segments,
+            stage_timings=stage_timings,
+            # The mix is already muxed into the output; the default cache is gone after the run
+            merged_audio_path=merged_audio_path if config.cache_dir else None,
+            camera_speakers=camera_speakers
+        )
         
     except Exception as e:
-        print(f"Error in process_videos: {str(e)}")
+        print(f"Error in run: {str(e)}")
         raise
 
+def process_videos(left_camera, main_camera, right_camera, left_audio, right_audio, output_path, 
+                  speaker_bias={'left': 1.2, 'main': 1.0, 'right': 1.0},
+                  min_clip_duration=20.0,
+                  audio_params=None,
+                  merge_audio=True,
+                  cache_dir=None,
+                  window_duration=None,
+                  window_overlap=2.0,
+                  project_id=None):
+    """
+    Process videos with configurable parameters; keyword front-end for run(ProcessingConfig)
+    """
+    return run(ProcessingConfig(
+        left_camera, main_camera, right_camera, left_audio, right_audio, output_path,
+        speaker_bias=dict(speaker_bias),
+        min_clip_duration=min_clip_duration,
+        audio_params=audio_params,
+        merge_audio=merge_audio,
+        cache_dir=cache_dir,
+        window_duration=window_duration,
+        window_overlap=window_overlap,
+        project_id=project_id
+    ))
+
 if __name__ == "__main__":
     if len(sys.argv) < 8:
         print("Usage: script.py left_camera main_camera right_camera left_audio right_audio output_path project_id [processing_params]")
@@ -600,74 +1359,45 @@ if __name__ == "__main__":
     # Get the basic parameters
     left_camera, main_camera, right_camera, left_audio, right_audio, output_path, project_id = sys.argv[1:8]
     
-    # Initialize default parameters
-    speaker_bias = {'left': 1.2, 'main': 1.0, 'right': 1.0}
-    min_clip_duration = 1.0
-    merge_audio = True
-    audio_params = {
-        'noise_reduction': 0.05,
-        'low_cut': 80,
-        'high_cut': 8000
-        # compression parameters will be determined automatically
-    }
-    
     # If processing parameters are provided as JSON string
+    processing_params = None
     if len(sys.argv) > 8:
         try:
-            import json
             processing_params = json.loads(sys.argv[8])
-            
-            # Update speaker bias if provided
-            if 'speaker_bias' in processing_params:
-                speaker_bias.update(processing_params['speaker_bias'])
-            
-            # Update min clip duration if provided
-            if 'min_clip_duration' in processing_params:
-                min_clip_duration = float(processing_params['min_clip_duration'])
-            
-            # Update audio merging preference if provided
-            if 'merge_audio' in processing_params:
-                merge_audio = bool(processing_params['merge_audio'])
-            
-            # Update audio parameters if provided
-            if 'audio_params' in processing_params:
-                audio_params.update(processing_params['audio_params'])
-                
-            print("Using custom processing parameters:")
-            print(f"Speaker bias: {speaker_bias}")
-            print(f"Min clip duration: {min_clip_duration}")
-            print(f"Merge audio: {merge_audio}")
-            print(f"Audio parameters: {audio_params}")
         except Exception as e:
             print(f"Error parsing processing parameters: {str(e)}")
             print("Using default parameters")
-    
-    # print durations of each file
-    print(f"Left camera duration: {VideoFileClip(left_camera).duration}")
-    print(f"Main camera duration: {VideoFileClip(main_camera).duration}")
-    print(f"Right camera duration: {VideoFileClip(right_camera).duration}")
-    print(f"Left audio duration: {AudioFileClip(left_audio).duration}")
-    print(f"Right audio duration: {AudioFileClip(right_audio).duration}")
-    
+
+    config = ProcessingConfig.from_params(left_camera, main_camera, right_camera, left_audio, right_audio,
+                                          output_path, project_id, processing_params)
+    if processing_params:
+        print("Using custom processing parameters:")
+        print(f"Speaker bias: {config.speaker_bias}")
+        print(f"Min clip duration: {config.min_clip_duration}")
+        print(f"Merge audio: {config.merge_audio}")
+        print(f"Audio parameters: {config.audio_params}")
+
     # Validate input files exist
-    input_files = [left_camera, main_camera, right_camera, left_audio, right_audio]
-    for file_path in input_files:
-        if not os.path.exists(file_path):
-            print(f"Error: File not found: {file_path}")
-            sys.exit(1)
-    
-    process_videos(
-        left_camera, 
-        main_camera, 
-        right_camera, 
-        left_audio, 
-        right_audio, 
-        output_path,
-        speaker_bias=speaker_bias,
-        min_clip_duration=min_clip_duration,
-        audio_params=audio_params,
-        merge_audio=merge_audio
-    )
+    try:
+        config.validate()
+    except FileNotFoundError as e:
+        report_error(str(e))
+        print(f"Error: {str(e)}")
+        sys.exit(1)
+
+    # print durations of each file (container headers only, cached)
+    for label, file_path in zip(["Left camera", "Main camera", "Right camera", "Left audio", "Right audio"],
+                                config.input_paths):
+        print(f"{label} duration: {probe_media(file_path)['duration']}")
     
-    print(f"Processing completed. Output saved to {output_path}")
+    try:
+        result = run(config)
+    except Exception as e:
+        report_error(str(e))
+        traceback.print_exc(file=sys.stderr)
+        # Don't wait on the other workers' tasks at exit
+        shutdown_pool(terminate=True)
+        sys.exit(1)
 
+    print(f"Processing completed. Output saved to {result.output_path}")
+    report_result(result.to_dict())
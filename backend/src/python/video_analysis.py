@@ -1,10 +1,17 @@
 import os
+import base64
 import tempfile
 import subprocess
+import bisect
+import cv2
 import boto3
 import openai
-from PIL import Image
-import io
+from media_probe import probe_media
+from frame_sampler import read_frames_at
+from shot_index import get_shot_index, shot_of, shot_sample_frames
+
+# Long shots get another description every this many seconds
+DESCRIPTION_INTERVAL = 10
 
 s3 = boto3.client('s3')
 openai.api_key = os.getenv('OPENAI_API_KEY')
@@ -13,8 +20,6 @@ def analyze_video_content(video_url):
     with tempfile.TemporaryDirectory() as temp_dir:
         input_video = os.path.join(temp_dir, 'input.mp4')
         audio_file = os.path.join(temp_dir, 'audio.mp3')
-        frames_dir = os.path.join(temp_dir, 'frames')
-        os.makedirs(frames_dir, exist_ok=True)
 
         # Download the input video
         s3.download_file('your-bucket-name', video_url, input_video)
@@ -22,40 +27,56 @@ def analyze_video_content(video_url):
         # Extract audio from video
         subprocess.run(['ffmpeg', '-i', input_video, '-q:a', '0', '-map', 'a', audio_file], check=True)
 
-        # Generate frames (1 per second)
-        subprocess.run(['ffmpeg', '-i', input_video, '-vf', 'fps=1', f'{frames_dir}/frame%d.jpg'], check=True)
-
         # Get video duration
-        result = subprocess.run(['ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'default=noprint_wrappers=1:nokey=1', input_video], capture_output=True, text=True, check=True)
-        duration = int(float(result.stdout))
+        duration = int(probe_media(input_video)['duration'])
 
         # Transcribe audio using OpenAI Whisper API
         with open(audio_file, 'rb') as audio:
             transcript = openai.Audio.transcribe("whisper-1", audio)['text']
 
-        # Analyze frames using OpenAI API
+        # Describe one frame per shot (and every DESCRIPTION_INTERVAL seconds in long shots)
+        # instead of one per second; each second reuses the latest description in its shot
+        shots = get_shot_index(input_video)
+        fps = shots["fps"]
+        sample_frames = shot_sample_frames(shots, DESCRIPTION_INTERVAL * fps)
+        frames = read_frames_at(input_video, sample_frames)
+
+        descriptions = {}
+        for frame_number in sample_frames:
+            frame = frames.get(frame_number)
+            if frame is None:
+                continue
+            ok, jpeg = cv2.imencode('.jpg', frame)
+            if not ok:
+                continue
+            img_base64 = base64.b64encode(jpeg.tobytes()).decode('utf-8')
+
+            response = openai.ChatCompletion.create(
+                model="gpt-4-vision-preview",
+                messages=[
+                    {
+                        "role": "user",
+                        "content": [
+                            {"type": "text", "text": "Describe what's happening in this image in a single sentence."},
+                            {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{img_base64}"}}
+                        ],
+                    }
+                ],
+            )
+            descriptions[frame_number] = response.choices[0].message.content
+
+        # Same keys as before: one description per second of video
+        described = sorted(descriptions)
+        described_shots = shot_of(shots, described).tolist()
         frame_descriptions = {}
         for i in range(1, duration + 1):
-            frame_path = os.path.join(frames_dir, f'frame{i}.jpg')
-            if os.path.exists(frame_path):
-                with Image.open(frame_path) as img:
-                    img_byte_arr = io.BytesIO()
-                    img.save(img_byte_arr, format='JPEG')
-                    img_byte_arr = img_byte_arr.getvalue()
-
-                response = openai.ChatCompletion.create(
-                    model="gpt-4-vision-preview",
-                    messages=[
-                        {
-                            "role": "user",
-                            "content": [
-                                {"type": "text", "text": "Describe what's happening in this image in a single sentence."},
-                                {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{img_byte_arr.decode('utf-8')}"}}
-                            ],
-                        }
-                    ],
-                )
-                frame_descriptions[i] = response.choices[0].message.content
+            frame_number = int((i - 1) * fps)
+            position = bisect.bisect_right(described, frame_number) - 1
+            # Seconds before a shot's first sample use that sample
+            if position < 0 or described_shots[position] != shot_of(shots, [frame_number])[0]:
+                position += 1
+            if 0 <= position < len(described):
+                frame_descriptions[i] = descriptions[described[position]]
 
     return {"transcript": transcript, "frame_descriptions": frame_descriptions}
 
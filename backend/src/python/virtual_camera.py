@@ -0,0 +1,114 @@
+import numpy as np
+from scipy.signal import lfilter, lfilter_zi
+from crop_render import expand_boxes, fit_to_aspect
+
+
+def keyframe_targets(detections, width, height, expand_factor=2.75):
+    """(times, centers x, centers y, crop widths) the camera should frame at each detection"""
+    rects = fit_to_aspect(expand_boxes(detections.boxes, width, height, expand_factor), width / height).astype(np.float64)
+    x, y, w, h = rects.T
+    return detections.times, x + w / 2, y + h / 2, w
+
+def apply_dead_zone(cx, cy, cw, dead_zone):
+    """
+    Keep the previous target while a new one moves less than dead_zone * crop width
+    (and changes the crop width by less than that fraction), so detection jitter
+    doesn't turn into camera motion. Runs over the sparse keyframes only.
+    """
+    cx, cy, cw = cx.copy(), cy.copy(), cw.copy()
+    for k in range(1, len(cx)):
+        tolerance = dead_zone * cw[k - 1]
+        if (abs(cx[k] - cx[k - 1]) < tolerance and abs(cy[k] - cy[k - 1]) < tolerance
+                and abs(cw[k] - cw[k - 1]) < tolerance):
+            cx[k], cy[k], cw[k] = cx[k - 1], cy[k - 1], cw[k - 1]
+    return cx, cy, cw
+
+def rate_limited_steps(start_frames, values, initial, total_frames, max_step):
+    """
+    Per-frame signal that holds each keyframe value from its start frame on, but moves
+    towards it by at most max_step per frame. Each hold becomes a linear ramp computed
+    in one vectorized expression; only the loop over keyframes is in Python.
+    """
+    out = np.full(total_frames, initial, dtype=np.float64)
+    current = initial
+    bounds = list(start_frames) + [total_frames]
+    for k, target in enumerate(values):
+        begin, end = bounds[k], bounds[k + 1]
+        if begin >= end:
+            continue
+        elapsed = np.arange(end - begin, dtype=np.float64)
+        delta = target - current
+        out[begin:end] = current + np.sign(delta) * np.minimum(abs(delta), max_step * (elapsed + 1))
+        current = out[end - 1]
+    return out
+
+def critically_damped(signal, fps, response_time):
+    """
+    Critically damped spring as two cascaded one-pole low-passes with the same pole,
+    run in one lfilter call. The impulse response is non-negative and sums to one,
+    so the rate limit applied before it still holds afterwards.
+    """
+    if response_time <= 0 or len(signal) == 0:
+        return signal
+    pole = np.exp(-1.0 / (response_time * fps))
+    b = [(1 - pole) ** 2]
+    a = [1, -2 * pole, pole ** 2]
+    # Start at rest on the first value instead of ramping up from zero
+    smoothed, _ = lfilter(b, a, signal, zi=lfilter_zi(b, a) * signal[0])
+    return smoothed
+
+def smooth_path(start_frames, values, total_frames, max_step, fps, response_time, cuts=()):
+    """
+    Rate-limited, spring-smoothed per-frame path through step-held keyframe values.
+    At cuts (frame numbers) the path jumps to the held value and smoothing restarts,
+    so the camera never pans across a hard cut in the source.
+    """
+    path = np.empty(total_frames, dtype=np.float64)
+    held = np.searchsorted(start_frames, np.arange(total_frames), side='right') - 1
+    bounds = [0] + [int(cut) for cut in cuts if 0 < cut < total_frames] + [total_frames]
+    for begin, end in zip(bounds, bounds[1:]):
+        inside = (start_frames > begin) & (start_frames < end)
+        local = rate_limited_steps(start_frames[inside] - begin, values[inside], values[held[begin]],
+                                   end - begin, max_step)
+        path[begin:end] = critically_damped(local, fps, response_time)
+    return path
+
+def virtual_camera_track(detections, total_frames, fps, width, height,
+                         expand_factor=2.75, dead_zone=0.08, max_pan_speed=0.6,
+                         response_time=0.35, cuts=()):
+    """
+    Smoothed per-frame crop track (x, y, w, h) for render_crop_track.
+
+    detections: sparse detections as a DetectionTimeline
+    dead_zone: fraction of the crop width a target may move before the camera follows
+    max_pan_speed: pan and zoom speed limit in frame widths per second
+    response_time: spring time constant in seconds
+    cuts: first frames of shots in the source (see shot_index); the camera cuts with them
+    Gaps between detections hold the last target; before the first one the full frame is shown.
+    """
+    full_frame = np.tile(np.array([0, 0, width, height], dtype=np.int32), (total_frames, 1))
+    if not len(detections) or total_frames == 0:
+        return full_frame
+
+    aspect = width / height
+    times, cx, cy, cw = keyframe_targets(detections, width, height, expand_factor)
+    cx, cy, cw = apply_dead_zone(cx, cy, cw, dead_zone)
+
+    start_frames = np.clip(np.round(times * fps).astype(np.int64), 0, total_frames)
+    max_step = max_pan_speed * width / fps
+    # The full frame is the resting position before the first detection
+    start_frames = np.concatenate([[0], start_frames])
+    cx = np.concatenate([[width / 2], cx])
+    cy = np.concatenate([[height / 2], cy])
+    cw = np.concatenate([[width], cw])
+
+    path_x = smooth_path(start_frames, cx, total_frames, max_step, fps, response_time, cuts)
+    path_y = smooth_path(start_frames, cy, total_frames, max_step, fps, response_time, cuts)
+    path_w = smooth_path(start_frames, cw, total_frames, max_step, fps, response_time, cuts)
+
+    path_w = np.clip(path_w, 2, width)
+    path_h = np.minimum(path_w / aspect, height)
+    path_w = path_h * aspect
+    x = np.clip(path_x - path_w / 2, 0, width - path_w)
+    y = np.clip(path_y - path_h / 2, 0, height - path_h)
+    return np.column_stack([x, y, path_w, path_h]).round().astype(np.int32)
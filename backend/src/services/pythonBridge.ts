@@ -1,9 +1,53 @@
 import { spawn } from 'child_process';
 import * as path from 'path';
 
+// Newline-delimited JSON events emitted by src/python/reporting.py
+export interface PythonEvent {
+  event:
+    | 'stage_start'
+    | 'stage_progress'
+    | 'stage_end'
+    | 'progress'
+    | 'error'
+    | 'result'
+    | string;
+  ts: number;
+  stage?: string;
+  progress?: number;
+  fraction?: number;
+  duration?: number;
+  frames?: number;
+  fps?: number;
+  realtime_factor?: number;
+  peak_rss_mb?: number;
+  result?: any;
+  [key: string]: unknown;
+}
+
+// stderr kept for the error message of a failed script; only its tail is useful
+const MAX_STDERR_CHARS = 64 * 1024;
+
+export interface PythonScriptOptions {
+  onEvent?: (event: PythonEvent) => void;
+}
+
+function parseEventLine(line: string): PythonEvent | null {
+  const trimmed = line.trim();
+  if (!trimmed.startsWith('{')) {
+    return null;
+  }
+  try {
+    const parsed = JSON.parse(trimmed);
+    return parsed && typeof parsed.event === 'string' ? parsed : null;
+  } catch (error) {
+    return null;
+  }
+}
+
 export async function runPythonScript(
   scriptName: string,
-  args: string[]
+  args: string[],
+  options: PythonScriptOptions = {}
 ): Promise<any> {
   return new Promise((resolve, reject) => {
     const scriptPath = path.join(__dirname, '..', 'python', scriptName);
@@ -20,32 +64,75 @@ export async function runPythonScript(
 
     const pythonProcess = spawn(pythonPath, [scriptPath, ...args]);
 
-    let stdout = '';
     let stderr = '';
+    // Incomplete trailing line from the last stdout chunk
+    let pending = '';
+    let result: any = undefined;
+    let errorMessage: string | undefined = undefined;
+    // Scripts without a result event print their JSON result as the last line
+    let lastLine = '';
+
+    const handleLine = (line: string) => {
+      const event = parseEventLine(line);
+      if (!event) {
+        if (line.trim()) {
+          lastLine = line;
+        }
+        return;
+      }
+      if (event.event === 'result') {
+        result = event.result;
+      } else if (event.event === 'error') {
+        errorMessage = String(event.message);
+      } else if (event.event === 'stage_end') {
+        console.log(
+          `Python stage ${event.stage}: ${event.duration}s` +
+            (event.fps !== undefined ? `, ${event.fps} fps` : '') +
+            (event.realtime_factor !== undefined
+              ? `, ${event.realtime_factor}x realtime`
+              : '') +
+            `, peak RSS ${event.peak_rss_mb} MB`
+        );
+      }
+      options.onEvent?.(event);
+    };
 
     pythonProcess.stdout.on('data', (data) => {
       const output = data.toString();
       console.log(`Python stdout: ${output}`);
-      stdout += output;
+
+      const lines = (pending + output).split('\n');
+      pending = lines.pop() ?? '';
+      lines.forEach(handleLine);
     });
 
     pythonProcess.stderr.on('data', (data) => {
       const output = data.toString();
       console.error(`Python stderr: ${output}`);
-      stderr += output;
+      stderr = (stderr + output).slice(-MAX_STDERR_CHARS);
     });
 
     pythonProcess.on('close', (code) => {
+      if (pending) {
+        handleLine(pending);
+        pending = '';
+      }
       console.log(`Python process exited with code ${code}`);
       if (code !== 0) {
         reject(
-          new Error(`Python script exited with code ${code}\nstderr: ${stderr}`)
+          new Error(
+            `Python script exited with code ${code}` +
+              (errorMessage ? `: ${errorMessage}` : '') +
+              `\nstderr: ${stderr}`
+          )
         );
+      } else if (result !== undefined) {
+        resolve(result);
       } else {
         try {
-          resolve(JSON.parse(stdout));
+          resolve(JSON.parse(lastLine));
         } catch (error) {
-          resolve(stdout);
+          resolve(lastLine);
         }
       }
     });
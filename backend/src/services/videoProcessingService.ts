@@ -5,7 +5,7 @@ import { exec } from 'child_process';
 import { log, promisify } from 'util';
 import axios from 'axios';
 import FormData from 'form-data';
-import { runPythonScript } from './pythonBridge';
+import { type PythonEvent, runPythonScript } from './pythonBridge';
 import os from 'os';
 
 const execPromise = promisify(exec);
@@ -91,6 +91,23 @@ export async function processAndUploadFiles({
   return finalVideoUrl;
 }
 
+// Progress and error events of a Python script, logged under the job's label
+function logPythonEvents(label: string) {
+  let lastProgress: number | undefined = undefined;
+  return (event: PythonEvent) => {
+    if (event.event === 'progress' && event.progress !== lastProgress) {
+      lastProgress = event.progress;
+      console.log(`${label}: ${event.progress}%`);
+    } else if (event.event === 'stage_progress') {
+      console.log(
+        `${label}: ${event.stage} ${Math.round((event.fraction ?? 0) * 100)}%`
+      );
+    } else if (event.event === 'error') {
+      console.error(`${label} failed: ${event.message}`);
+    }
+  };
+}
+
 export async function detectSpeakerAndZoom(
   videoUrl: string,
   projectId: string
@@ -105,11 +122,11 @@ export async function detectSpeakerAndZoom(
     await downloadFileFromS3(videoUrl, inputVideo);
     console.log(`Input video downloaded to: ${inputVideo}`);
 
-    const result = await runPythonScript('speaker_detection_zoom.py', [
-      inputVideo,
-      outputVideo,
-      projectId,
-    ]);
+    const result = await runPythonScript(
+      'speaker_detection_zoom.py',
+      [inputVideo, outputVideo, projectId],
+      { onEvent: logPythonEvents(`Speaker zoom ${projectId}`) }
+    );
 
     const outputBuffer = await fs.promises.readFile(outputVideo);
     const processedFileName = path.basename(outputVideo);
@@ -148,6 +165,28 @@ interface ProcessingParams {
   speaker_bias?: SpeakerBias;
   min_clip_duration?: number;
   audio_params?: AudioParams;
+  // Process long episodes in windows of this many seconds to bound memory
+  window_duration?: number;
+}
+
+// Client-settable params only: processingParams comes straight from the request body,
+// so anything else (e.g. where the script may write) is set by the service itself
+function clientProcessingParams(
+  params: ProcessingParams = {}
+): ProcessingParams {
+  const { speaker_bias, min_clip_duration, audio_params, window_duration } =
+    params;
+  if (
+    window_duration !== undefined &&
+    !(
+      typeof window_duration === 'number' &&
+      Number.isFinite(window_duration) &&
+      window_duration > 0
+    )
+  ) {
+    throw new Error('window_duration must be a positive number of seconds');
+  }
+  return { speaker_bias, min_clip_duration, audio_params, window_duration };
 }
 
 export async function syncDetectAndSwap({
@@ -171,6 +210,8 @@ export async function syncDetectAndSwap({
   processingParams?: ProcessingParams;
   isLocalTesting?: boolean;
 }): Promise<string> {
+  // Rejects bad params before anything is downloaded
+  const clientParams = clientProcessingParams(processingParams);
   const tempDir = path.join(os.tmpdir(), 'sync_detect_swap');
   await fs.promises.mkdir(tempDir, { recursive: true });
 
@@ -180,6 +221,13 @@ export async function syncDetectAndSwap({
   const localLeftAudio = path.join(tempDir, 'left_audio.wav');
   const localRightAudio = path.join(tempDir, 'right_audio.wav');
   const outputVideo = path.join(tempDir, `${projectId}_processed.mp4`);
+  // Stage checkpoints per project: kept when the job fails so a retry resumes from the
+  // last completed stage, removed once the result is delivered
+  const cacheDir = path.join(
+    tempDir,
+    'cache',
+    projectId.replace(/[^A-Za-z0-9_.-]/g, '_')
+  );
 
   try {
     if (isLocalTesting) {
@@ -216,15 +264,19 @@ export async function syncDetectAndSwap({
     ];
 
     const defaultParams = {
-      ...processingParams,
+      ...clientParams,
       merge_audio: false,
+      cache_dir: cacheDir,
     };
     args.push(JSON.stringify(defaultParams));
 
-    await runPythonScript('sync_detect_swap.py', args);
+    await runPythonScript('sync_detect_swap.py', args, {
+      onEvent: logPythonEvents(`Sync and swap ${projectId}`),
+    });
 
     // For testing, you might want to just return the local path
     if (isLocalTesting) {
+      await fs.promises.rm(cacheDir, { recursive: true, force: true });
       return outputVideo;
     }
 
@@ -245,6 +297,7 @@ export async function syncDetectAndSwap({
       fs.promises.unlink(localLeftAudio),
       fs.promises.unlink(localRightAudio),
       fs.promises.unlink(outputVideo),
+      fs.promises.rm(cacheDir, { recursive: true, force: true }),
     ]);
 
     return processedVideoUrl;